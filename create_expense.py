@@ -1,24 +1,26 @@
 import os
-import csv
 import sys
 import subprocess
 import argparse
-from collections import defaultdict
+from collections import deque
+from functools import partial
 from datetime import datetime
-from pdf2image import convert_from_path
-from PIL import Image
 import shutil
-import re
-from PyPDF2 import PdfReader, PdfWriter, PdfMerger
-from python.add_transactions import add_transactions_from_estatements
+from PyPDF2 import PdfReader, PdfWriter
 from python.insert_into_pdf import create_reimbursement_form
-from python.censor_transactions import censor_transactions_mainloop
 from python.custom_transactions import process_transactions_custom
+from python.page_cache import PageTextCache, iter_pdf_files
+from python.transaction_index import TransactionIndex, DEFAULT_FUZZY_THRESHOLD
+from python.multi_pattern import read_search_terms
+from python.text_backends import BACKENDS, prefilter_matches
+from python.profiling import profiler
+from python.raster_cache import shared_raster_pool, set_raster_workers, RENDER_MODES, DEFAULT_RENDER_MODE, DEFAULT_RASTER_WORKERS
 
 class ScriptState:
     def __init__(self):
         self.results = []
-        self.selected_result = ""
+        self.matched_strings = {}
+        self.selected_result = None
         self.selected_file = ""
         self.selected_page = ""
         self.selected_month = ""
@@ -28,6 +30,12 @@ class ScriptState:
         self.year = "2024"
         self.editor = "vim"
         self.mode = ""
+        self.workers = 1
+        self.fuzzy_threshold = DEFAULT_FUZZY_THRESHOLD
+        self.text_backend = None
+        self.prefilter = False
+        self.censor_mode = "gui"
+        self.render_mode = DEFAULT_RENDER_MODE
         self.signed_reimbursement_form_path = "/home/vasilii/Documents/Expenses/2024/Cosmolunch/Reimbursement_form_with_sign.pdf"
         self.unsigned_reimbursement_form_path = "/home/vasilii/Documents/Expenses/Expense_form_empty.pdf"
 
@@ -39,45 +47,53 @@ def check_dependencies():
         print("Required libraries not found. Please install PyPDF2 and pdf2image.")
         sys.exit(1)
 
-def scan_pdfs(state, directory, search_string):
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.pdf'):
-                file_path = os.path.join(root, file)
-                try:
-                    pdf = PdfReader(file_path)
-                    for page_num, page in enumerate(pdf.pages, 1):
-                        text = page.extract_text()
-                        lines = text.split('\n')
-                        for i, line in enumerate(lines):
-                            if search_string in line:
-                                # Get the full transaction line
-                                transaction_line = line.strip()
-                                # Get the next line for the amount if it exists
-                                amount_line = lines[i+1].strip() if i+1 < len(lines) else ""
-                                # Combine the transaction line and amount line
-                                full_transaction = f"{transaction_line} {amount_line}"
-                                state.results.append(f"{file_path}: Page {page_num}: {full_transaction}")
-                except Exception as e:
-                    print(f"Error processing {file_path}: {str(e)}")
-
-def present_results(state, search_string):
+def scan_pdfs(state, directory, search_strings):
+    """
+    Finds the transactions whose first statement line contains any of <search_strings> (a string or a
+    list of strings, matched case-sensitively in a single pass). The matched strings of every result
+    are kept in state.matched_strings, keyed by record id.
+    With state.prefilter, statements that are not cached yet are only read if pdfgrep finds a match in them.
+    """
+    if isinstance(search_strings, str):
+        search_strings = [search_strings]
+    cache = PageTextCache(directory, backend=state.text_backend)
+    file_paths = list(iter_pdf_files(directory))
+    if state.prefilter:
+        file_paths = [file_path for file_path in file_paths
+                      if cache.is_fresh(file_path) or prefilter_matches(file_path, search_strings)]
+    if state.workers > 1:
+        for _ in cache.extract_parallel(file_paths, state.workers):
+            pass
+    index = TransactionIndex()
+    index.update(cache, file_paths)
+    cache.close()
+
+    matcher = index.build_matcher(search_strings, case_sensitive=True)
+    matches = index.lookup_patterns(matcher, case_sensitive=True)
+    state.results = [record for record, _ in matches]
+    state.matched_strings = {record.record_id: matched for record, matched in matches}
+
+def present_results(state, search_strings):
+    if isinstance(search_strings, str):
+        search_strings = [search_strings]
+    search_label = "', '".join(search_strings)
     if not state.results:
-        print(f"No occurrences of '{search_string}' found in any PDF files.")
+        print(f"No occurrences of '{search_label}' found in any PDF files.")
         sys.exit(0)
 
-    print(f"Found the following occurrences of '{search_string}':")
+    print(f"Found the following occurrences of '{search_label}':")
     for i, result in enumerate(state.results):
-        print(f"[{i}] {result}")
+        if len(search_strings) > 1:
+            print(f"[{i}] [{', '.join(state.matched_strings[result.record_id])}] {result.file}: Page {result.page}: {result.text}")
+        else:
+            print(f"[{i}] {result.file}: Page {result.page}: {result.text}")
 
 def prompt_user_selection(state):
     while True:
         try:
             selection = int(input("Enter the number of the occurrence you want to select: "))
             if 0 <= selection < len(state.results):
-                state.selected_result = state.results[selection]
-                state.selected_file, rest = state.selected_result.split(': Page ')
-                state.selected_page = rest.split(':')[0]
+                select_result(state, selection)
                 return
             else:
                 print("Invalid selection. Please try again.")
@@ -88,23 +104,18 @@ def autoloop_selection(state, i):
     if not (0 <= i < len(state.results)):
         print("Checking the last one...")
         return 1
-    state.selected_result = state.results[i]
-    state.selected_file, rest = state.selected_result.split(': Page ')
-    state.selected_page = rest.split(':')[0]
+    select_result(state, i)
     return 0
 
+def select_result(state, i):
+    state.selected_result = state.results[i]
+    state.selected_file = state.selected_result.file
+    state.selected_page = str(state.selected_result.page)
+
 def extract_date_info(state):
-    date_match = re.search(r'\b([A-Z]{3})\s+(\d{2})\b', state.selected_result)
-    if date_match:
-        month_abbr, state.selected_day = date_match.groups()
-        month_dict = {'JAN': '01', 'FEB': '02', 'MAR': '03', 'APR': '04', 'MAY': '05', 'JUN': '06',
-                      'JUL': '07', 'AUG': '08', 'SEP': '09', 'OCT': '10', 'NOV': '11', 'DEC': '12'}
-        state.selected_month = month_dict.get(month_abbr, '??')
-    
-    amount_match = re.search(r'\$(\d+(\.\d{2})?)', state.selected_result)
-    if amount_match:
-        state.selected_amount = amount_match.group(1)
-        print(f"Here is the amount found: {state.selected_amount}")
+    state.selected_month, state.selected_day = state.selected_result.date.split('-')
+    state.selected_amount = state.selected_result.amount
+    print(f"Here is the amount found: {state.selected_amount}")
 
 def find_first_date_after(year, month, day, directory):
     """
@@ -130,15 +141,36 @@ def find_first_date_after(year, month, day, directory):
         print("No date found after the given date.")
         sys.exit(1)
 
-def convert_pdfs_to_jpegs(output_dir, quality):
+def save_jpeg(image, jpeg_path, pdf_path, page_num):
+    with profiler.span("save_jpeg", file=pdf_path, page=page_num):
+        image.save(jpeg_path, 'JPEG')
+
+def convert_pdfs_to_jpegs(output_dir, quality, render_mode=DEFAULT_RENDER_MODE):
+    """
+    Converts every page of the pdfs in <output_dir> to <name>-<page>.jpg, and removes the pdfs.
+    Pages are fed to the shared rasterization pool one per worker, and every worker encodes its page as
+    soon as it is rendered, so memory holds one page per worker however long the pdfs are.
+    """
+    pages = []
     for pdf_file in os.listdir(output_dir):
         if pdf_file.endswith('.pdf'):
             pdf_path = os.path.join(output_dir, pdf_file)
-            base_name = os.path.splitext(pdf_file)[0]
-            images = convert_from_path(pdf_path, dpi=quality)
-            for i, image in enumerate(images):
-                image.save(os.path.join(output_dir, f"{base_name}-{i+1}.jpg"), 'JPEG')
-            os.remove(pdf_path)
+            pages += [(pdf_path, page_num) for page_num in range(1, len(PdfReader(pdf_path).pages) + 1)]
+
+    with profiler.span("rasterize_pdfs", pages=len(pages), dpi=quality, mode=render_mode):
+        pool = shared_raster_pool()
+        window = deque()
+        for pdf_path, page_num in pages:
+            if len(window) >= pool.workers:
+                window.popleft().result()
+            jpeg_path = f"{os.path.splitext(pdf_path)[0]}-{page_num}.jpg"
+            window.append(pool.submit(
+                pdf_path, page_num, quality, RENDER_MODES[render_mode],
+                then=partial(save_jpeg, jpeg_path=jpeg_path, pdf_path=pdf_path, page_num=page_num)))
+        for future in window:
+            future.result()
+    for pdf_path in {pdf_path for pdf_path, _ in pages}:
+        os.remove(pdf_path)
 
 def censor_single_transaction(state, output_dir):
     """
@@ -155,7 +187,7 @@ def censor_single_transaction(state, output_dir):
         pdf_writer.write(output_pdf)
 
     # Convert to JPEG
-    convert_pdfs_to_jpegs(creditcard_out_dir, 300)
+    convert_pdfs_to_jpegs(creditcard_out_dir, 300, state.render_mode)
 
     print(f"\n\nNow you have to only enable transaction for {state.selected_month}-{state.selected_day}:")
     image_name = "1-1"
@@ -165,7 +197,6 @@ def censor_single_transaction(state, output_dir):
     print("Current implementation that we have here uses jpgs.") 
     print("You will have to edit the source to change this.")
     sys.exit(1)
-    censor_transactions_mainloop(image_path)
 
     for file in os.listdir(creditcard_out_dir):
         if file.endswith((".pdf", ".jpg")) and not file.startswith(image_name):
@@ -176,7 +207,8 @@ def combine_pdfs(output_dir, filename):
     os.makedirs(tmp_dir, exist_ok=True)
     os.chdir(tmp_dir)
 
-    subprocess.run(["pdflatex", f"../{output_dir}/description.tex"])
+    with profiler.span("pdflatex", file=f"../{output_dir}/description.tex"):
+        subprocess.run(["pdflatex", f"../{output_dir}/description.tex"])
     shutil.move("description.pdf", f"../{output_dir}")
     
     combine_files_to_pdf_with_exceptions(f"../{output_dir}", filename)
@@ -186,9 +218,12 @@ def combine_pdfs(output_dir, filename):
 
 def run_python_scripts(state, mode, output_dir, final_report_filename, 
                        reimbursement_form_path, config_file):
-    censor_single_transaction(state, output_dir)
-    create_reimbursement_form(state, output_dir, reimbursement_form_path, config_file)
-    combine_pdfs(output_dir, final_report_filename)
+    with profiler.span("censor", 'stage'):
+        censor_single_transaction(state, output_dir)
+    with profiler.span("fill_form", 'stage'):
+        create_reimbursement_form(state, output_dir, reimbursement_form_path, config_file)
+    with profiler.span("combine", 'stage'):
+        combine_pdfs(output_dir, final_report_filename)
 
 def process_transactions_cosmolunch(state, args, config_file):
     year = state.year
@@ -228,10 +263,31 @@ def parse_arguments():
     parser.add_argument("expense_reports_directory", help="Directory for expense reports")
     parser.add_argument("mode", help="Program mode")
     parser.add_argument("search_string", help="String to search for in PDFs")
+    parser.add_argument("--vendors-file", help="File with more search strings, one per line, matched in the same pass")
     parser.add_argument("--autoloop", action="store_true", help="Enable autoloop mode")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used to scan new eStatements")
+    parser.add_argument("--text-backend", choices=list(BACKENDS), help="Text extraction backend for new eStatements (default: the saved one, or pypdf2)")
+    parser.add_argument("--prefilter", action="store_true", help="Skip uncached eStatements in which pdfgrep finds no search string")
+    parser.add_argument("--profile", nargs='?', const='profile', metavar="DIR",
+                        help="Record the time spent in every stage and write a JSON summary and a Chrome trace to DIR (default: ./profile)")
+    parser.add_argument("--cprofile", action="store_true", help="With --profile, also dump cProfile statistics of every stage")
+    parser.add_argument("--memprofile", action="store_true",
+                        help="Record the peak memory and the top allocation sites of every stage (slow; implies --profile)")
+    parser.add_argument("--censor", choices=["gui", "auto", "review"], default="gui",
+                        help="Censor statement pages by hand (gui), from the text positions without a GUI (auto), "
+                             "or from the text positions with a GUI review (review)")
+    parser.add_argument("--render-mode", choices=list(RENDER_MODES), default=DEFAULT_RENDER_MODE,
+                        help="Colors of the rendered statement pages: rgb, 8-bit gray or 1-bit black and white (mono)")
+    parser.add_argument("--raster-workers", type=int, default=DEFAULT_RASTER_WORKERS,
+                        help=f"Number of pages rendered at once (default: {DEFAULT_RASTER_WORKERS})")
+    parser.add_argument("--fuzzy-threshold", type=float, default=DEFAULT_FUZZY_THRESHOLD,
+                        help=f"Minimum similarity (0-1) of '~' fuzzy search results (default: {DEFAULT_FUZZY_THRESHOLD})")
     args = parser.parse_args()
     args.estatements_directory = os.path.abspath(args.estatements_directory)
     args.expense_reports_directory = os.path.abspath(args.expense_reports_directory)
+    args.search_strings = [args.search_string]
+    if args.vendors_file:
+        args.search_strings += read_search_terms(args.vendors_file)
     return args
 
 def create_expense_main():
@@ -247,25 +303,40 @@ def create_expense_main():
     config_file = os.path.abspath(config_file)
 
     state.mode = args.mode
+    state.workers = args.workers
+    state.fuzzy_threshold = args.fuzzy_threshold
+    state.text_backend = args.text_backend
+    state.prefilter = args.prefilter
+    state.censor_mode = args.censor
+    state.render_mode = args.render_mode
+    set_raster_workers(args.raster_workers)
     #state.mode = "cosmolunch" if "Cosmolunch" in args.expense_reports_directory else "other"
     #state.mode = "test"
     #state.mode = "custom"
 
-    if state.mode == "cosmolunch": 
-        print("Cosmolunch mode")
-        scan_pdfs(state, args.estatements_directory, args.search_string)
-        present_results(state, args.search_string)
-        process_transactions_cosmolunch(state, args, config_file)
-    elif state.mode == "custom": # Enter transactions from the receipts, and generate the report based on the eStatements
-        print("Custom mode")
-        process_transactions_custom(state, args, config_file)
-    elif state.mode == "test": 
-        print("Test mode")
-        scan_pdfs(state, args.estatements_directory, args.search_string)
-        present_results(state, args.search_string)
-        process_transactions_cosmolunch(state, args, config_file)
-    else:
-        print("Mode not supported")
+    if args.profile or args.memprofile:
+        profiler.enable(args.profile or 'profile', cprofile=args.cprofile, memory=args.memprofile)
+    try:
+        if state.mode == "cosmolunch": 
+            print("Cosmolunch mode")
+            with profiler.span("scan_statements", 'stage'):
+                scan_pdfs(state, args.estatements_directory, args.search_strings)
+            present_results(state, args.search_strings)
+            process_transactions_cosmolunch(state, args, config_file)
+        elif state.mode == "custom": # Enter transactions from the receipts, and generate the report based on the eStatements
+            print("Custom mode")
+            process_transactions_custom(state, args, config_file)
+        elif state.mode == "test": 
+            print("Test mode")
+            with profiler.span("scan_statements", 'stage'):
+                scan_pdfs(state, args.estatements_directory, args.search_strings)
+            present_results(state, args.search_strings)
+            process_transactions_cosmolunch(state, args, config_file)
+        else:
+            print("Mode not supported")
+    finally:
+        # Also written when the run stops early (no results, Ctrl-C, sys.exit)
+        profiler.write()
 
 if __name__ == "__main__":
     create_expense_main()
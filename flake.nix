@@ -20,6 +20,7 @@
         devShell = pkgs.mkShell {
           buildInputs = with pkgs; [
 			pdfgrep
+			poppler_utils
 			cargo
 			rustc
             (python311.withPackages (ps: with ps; [
@@ -28,6 +29,7 @@
 			  reportlab
 			  pypdf2
 			  pdf2image
+			  inotify-simple
             ]))
           ];
         };
@@ -4,9 +4,12 @@ import sys
 import re
 import subprocess
 from datetime import datetime, timedelta
-from PyPDF2 import PdfReader
 from python.full_reimbursement import define_categories, category_to_row
 from python.define_table import define_reimbursement_table
+from python.page_cache import PageTextCache, iter_pdf_files
+from python.transaction_index import TransactionIndex, DEFAULT_FUZZY_THRESHOLD
+from python.multi_pattern import read_search_terms
+from python.text_backends import prefilter_matches
 
 class Transaction:
     def __init__(self, date, filepath, page, amount, subcategory=None):
@@ -34,103 +37,94 @@ class Transaction:
         return datetime.strptime(self.date, "%m-%d").strftime("%d")
 
 class TransactionFinder:
-    def __init__(self, estatements_dir, debug=False):
+    def __init__(self, estatements_dir, debug=False, workers=1, text_backend=None, prefilter=False):
         self.estatements_dir = estatements_dir
         self.debug = debug
-
-    def find_transactions(self, search_term):
-        transactions = []
-        is_date = re.match(r"\d{2}-\d{2}", search_term)
-
-        if is_date:
-            target_date = datetime.strptime(search_term, "%m-%d")
-            date_range = [
-                (target_date - timedelta(days=1)).strftime("%b %d").upper(),
-                target_date.strftime("%b %d").upper(),
-                (target_date + timedelta(days=1)).strftime("%b %d").upper()
-            ]
-            if self.debug:
-                print(f"Searching for dates: {date_range}", file=sys.stderr)
-            search_terms = date_range
-        else:
-            if self.debug:
-                print(f"Searching for string: {search_term}", file=sys.stderr)
-            search_terms = [search_term.upper()]
-
-        for root, _, files in os.walk(self.estatements_dir):
-            for file in files:
-                if file.endswith('.pdf'):
-                    file_path = os.path.join(root, file)
-                    if self.debug:
-                        print(f"Scanning file: {file_path}", file=sys.stderr)
-                    file_transactions = self._scan_pdf(file_path, search_terms)
-                    transactions.extend(file_transactions)
-                    if self.debug:
-                        print(f"Found {len(file_transactions)} transactions in this file", file=sys.stderr)
-
+        self.workers = workers
+        self.prefilter = prefilter
+        self.cache = PageTextCache(estatements_dir, debug=debug, backend=text_backend)
+        self.index = TransactionIndex(debug=debug)
+
+    def fuzzy_transactions(self, query, threshold=DEFAULT_FUZZY_THRESHOLD):
+        """Returns (record, score) for the transactions whose description looks like <query>, best first"""
+        file_paths = list(iter_pdf_files(self.estatements_dir))
+        if self.workers > 1:
+            for _ in self.cache.extract_parallel(file_paths, self.workers):
+                pass
+        self.index.update(self.cache, file_paths)
+        return self.index.fuzzy_lookup(query, threshold)
+
+    def find_transactions(self, search_terms):
+        """
+        Returns the StatementRecords matching <search_terms>: a MM-DD date, a search string,
+        or a list of search strings that are all matched in a single pass
+        """
+        transactions = list(self.iter_transactions(search_terms))
         if self.debug:
             print(f"Total transactions found: {len(transactions)}", file=sys.stderr)
         return transactions
 
-    def _scan_pdf(self, file_path, search_terms):
-        transactions = []
-        try:
-            pdf = PdfReader(file_path)
-            for page_num, page in enumerate(pdf.pages, 1):
-                text = page.extract_text()
-                lines = text.split('\n')
-                for i, line in enumerate(lines):
-                    if any(term in line.upper() for term in search_terms):
-                        if self.debug:
-                            print(f"Found matching term in line: {line}", file=sys.stderr)
-                        transaction = self._parse_transaction(lines, i)
-                        if transaction:
-                            transactions.append((file_path, page_num, transaction))
-                            if self.debug:
-                                print(f"Added transaction: {transaction}", file=sys.stderr)
-                        else:
-                            if self.debug:
-                                print(f"Failed to parse transaction from line: {line}", file=sys.stderr)
-        except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}", file=sys.stderr)
-        return transactions
-
-    def _parse_transaction(self, lines, start_index):
-        transaction = lines[start_index].strip()
-        i = start_index
-
-        # Continue to the next lines until we find a line with a $
-        while i + 1 < len(lines) and '$' not in lines[i]:
-            i += 1
-            transaction += ' ' + lines[i].strip()
-
-        if self.debug:
-            print("This is the transaction string:")
-            print(transaction)
-            print(f"Parsing transaction: {transaction}", file=sys.stderr)
-
-        # Extract date
-        date_match = re.search(r'\b([A-Z]{3})\s+(\d{2})\b', transaction)
-        if date_match:
-            date = f"{date_match.group(1)} {date_match.group(2)}"
+    def iter_transactions(self, search_terms):
+        """Same as find_transactions, but yields the records as they are found"""
+        for transaction, _ in self.iter_tagged_transactions(search_terms):
+            yield transaction
+
+    def iter_tagged_transactions(self, search_terms):
+        """
+        Yields (record, matched_terms) for the transactions matching <search_terms>, in archive order.
+        matched_terms lists the (upper-cased) search strings found in the record; it is empty for dates.
+        Statements that still have to be indexed are searched one by one as soon as they are,
+        so that the first results show up before the whole archive has been read.
+        With prefilter set, uncached statements that pdfgrep finds no search string in are not indexed.
+        """
+        if isinstance(search_terms, str):
+            search_terms = [search_terms]
+
+        matcher = None
+        dates = None
+        if len(search_terms) == 1 and re.match(r"\d{2}-\d{2}", search_terms[0]):
+            target_date = datetime.strptime(search_terms[0], "%m-%d")
+            date_range = [target_date - timedelta(days=1), target_date, target_date + timedelta(days=1)]
             if self.debug:
-                print(f"Found date: {date}", file=sys.stderr)
+                print(f"Searching for dates: {[date.strftime('%b %d').upper() for date in date_range]}", file=sys.stderr)
+            dates = {(date.month, date.day) for date in date_range}
         else:
-            print("Failed to extract date", file=sys.stderr)
-            return None
-
-        # Extract amount
-        amount_match = re.search(r'(\d*\$\d+\.\d{2})', transaction)
-        if amount_match:
-            full_amount = amount_match.group(1)
-            amount = full_amount.split('$')[-1]
             if self.debug:
-                print(f"Found amount: ${amount}", file=sys.stderr)
-        else:
-            print("Failed to extract amount", file=sys.stderr)
-            return None
-
-        return f"{date} ${amount} - {transaction}"
+                print(f"Searching for strings: {search_terms}", file=sys.stderr)
+            matcher = self.index.build_matcher(search_terms)
+
+        file_paths = list(iter_pdf_files(self.estatements_dir))
+        self.index.set_files(file_paths)
+        stale = [file_path for file_path in file_paths if not self.index.is_current(file_path)]
+        if self.prefilter and matcher is not None:
+            skipped = {file_path for file_path in stale
+                       if not self.cache.is_fresh(file_path) and not prefilter_matches(file_path, matcher.patterns)}
+            for file_path in skipped:
+                self.index.remove_file(file_path)
+                if self.debug:
+                    print(f"Skipping file without matches: {file_path}", file=sys.stderr)
+            stale = [file_path for file_path in stale if file_path not in skipped]
+
+        if not stale:
+            if dates is not None:
+                for transaction in self.index.lookup_dates(dates):
+                    yield transaction, []
+            else:
+                yield from self.index.lookup_patterns(matcher)
+            return
+
+        if self.workers > 1:
+            # Extract the text of new statements in parallel; they come back in archive order
+            extracted = self.cache.extract_parallel(stale, self.workers)
+        stale_files = set(stale)
+        for file_path in file_paths:
+            if file_path in stale_files:
+                if self.workers > 1:
+                    next(extracted)
+                if self.debug:
+                    print(f"Scanning file: {file_path}", file=sys.stderr)
+                self.index.update_file(self.cache, file_path)
+            yield from self.index.match_file(file_path, matcher, dates)
 
 class TransactionAdder:
     def __init__(self, csv_file):
@@ -152,10 +146,6 @@ def get_unique_file_page_pairs(csv_filename):
             unique_pairs.add((row['file'], row['page']))
     return unique_pairs
 
-def format_date(date_str):
-    date = datetime.strptime(date_str, "%b %d")
-    return date.strftime("%m-%d")
-
 def extract_amount(transaction_str):
     parts = transaction_str.split('$')
     if len(parts) > 1:
@@ -188,11 +178,35 @@ def prompt_category(table_params):
     # Return the subcategory number according to the category_to_row dictionary
     return selected_category.name, category_to_row[selected_subcategory]
 
+def parse_search_input(search_input):
+    """
+    Several vendors can be searched at once, either separated by '|' (e.g. "PIZZAIOLO|UBER")
+    or listed one per line in a file given as "@path/to/vendors.txt"
+    """
+    if search_input.startswith('@'):
+        return read_search_terms(search_input[1:].strip())
+    return [term.strip() for term in search_input.split('|') if term.strip()]
+
+def search_transactions(finder, search_input, fuzzy_threshold=DEFAULT_FUZZY_THRESHOLD):
+    """
+    Yields (transaction, label) for the search typed by the user. "~PIZZAIOLO" is a fuzzy search,
+    labelled with the similarity; searches for several vendors are labelled with the vendor that matched.
+    """
+    if search_input.startswith('~'):
+        for transaction, score in finder.fuzzy_transactions(search_input[1:], fuzzy_threshold):
+            yield transaction, f"({score:.2f})"
+        return
+
+    search_terms = parse_search_input(search_input)
+    for transaction, matched_terms in finder.iter_tagged_transactions(search_terms):
+        yield transaction, f"[{', '.join(matched_terms)}]" if len(search_terms) > 1 else None
+
 def open_file_in_editor(state, file_path):
     subprocess.run([state.editor, file_path])
 
 def add_transactions_from_estatements(state, estatements_dir, csv_file):
-    finder = TransactionFinder(estatements_dir)
+    finder = TransactionFinder(estatements_dir, workers=state.workers,
+                               text_backend=state.text_backend, prefilter=state.prefilter)
     adder = TransactionAdder(csv_file)
 
     table_params = define_reimbursement_table(state.mode)
@@ -214,20 +228,29 @@ def add_transactions_from_estatements(state, estatements_dir, csv_file):
                 print("Sorry, your option is not available. Try again with 'c', 'e' or Enter")
 
     while True:
-        search_term = input("Enter a transaction posting date (MM-DD) or a search string, or 'c' to continue: ")
+        search_term = input("Enter a transaction posting date (MM-DD), search string(s) separated by '|', @vendors_file, ~fuzzy search, or 'c' to continue: ")
         if not search_term:
             search_term = 'c'
         if search_term.lower() == 'c':
             break
 
-        transactions = finder.find_transactions(search_term)
-        if not transactions:
-            print("No transactions found for the given search term.")
+        # Print the transactions as they are found; Ctrl-C stops the scan and keeps what was found so far
+        transactions = []
+        try:
+            for transaction, label in search_transactions(finder, search_term, state.fuzzy_threshold):
+                if not transactions:
+                    print("Found transactions:")
+                transactions.append(transaction)
+                print(f"{len(transactions)}. {label + ' ' if label else ''}{transaction.summary()}")
+        except OSError as e:
+            print(f"Could not read the vendors file: {e}")
             continue
+        except KeyboardInterrupt:
+            print(f"\nScan cancelled, keeping the {len(transactions)} transaction(s) found so far.")
 
-        print("Found transactions:")
-        for i, (file, page, transaction) in enumerate(transactions, 1):
-            print(f"{i}. {transaction}")
+        if not transactions:
+            print("No transactions found for the given search term. Start it with '~' for a fuzzy search.")
+            continue
 
         selections = input("Enter the numbers of transactions to add (comma-separated), 'a' for all, or 'q' to cancel: ")
         if selections.lower() == 'a':
@@ -238,27 +261,20 @@ def add_transactions_from_estatements(state, estatements_dir, csv_file):
             indices = [int(s.strip()) - 1 for s in selections.split(',')]
             selected_transactions = [transactions[i] for i in indices if 0 <= i < len(transactions)]
 
-        for file, page, transaction_details in selected_transactions:
-            parts = transaction_details.split(' - ', 1)
-            if len(parts) == 2:
-                date_amount, _ = parts
-                date, amount = date_amount.rsplit('$', 1)
-                date_formatted = format_date(date.strip())
-                amount = amount.strip()
-
-                change_amount = input(f"Would you like to change the amount for this transaction? (y/N): ")
-                if change_amount.lower() == 'y':
-                    current_amount = f"${amount}"
-                    print(f"Current amount for this transaction is {current_amount}. Please, enter a new amount:")
-                    amount = input("New amount: ").strip()
-
-                _, subcategory_number = prompt_category(table_params)
-                
-                trans = Transaction(date_formatted, file, page, amount, subcategory_number)
-                adder.add_transaction(trans)
-                print(f"Added: {transaction_details} with subcategory number {subcategory_number}")
-            else:
-                print(f"Failed to parse transaction details: {transaction_details}")
+        for transaction in selected_transactions:
+            amount = transaction.amount
+
+            change_amount = input(f"Would you like to change the amount for this transaction? (y/N): ")
+            if change_amount.lower() == 'y':
+                current_amount = f"${amount}"
+                print(f"Current amount for this transaction is {current_amount}. Please, enter a new amount:")
+                amount = input("New amount: ").strip()
+
+            _, subcategory_number = prompt_category(table_params)
+
+            trans = Transaction(transaction.date, transaction.file, transaction.page, amount, subcategory_number)
+            adder.add_transaction(trans)
+            print(f"Added: {transaction.summary()} with subcategory number {subcategory_number}")
 
     print("Transaction adding complete. Goodbye!")
 
@@ -0,0 +1,249 @@
+import io
+import os
+import csv
+import sys
+import json
+import argparse
+from reportlab.pdfgen import canvas
+from PyPDF2 import PdfReader, PdfWriter
+from python.statement_parser import parse_page, DATE_REGEX
+from python.raster_cache import file_hash
+
+# Statement fonts have no widths in the extracted text, so line ends are estimated from the
+# number of characters, with an average glyph width a bit wider than Helvetica's
+CHAR_WIDTH = 0.6
+ASCENT = 0.9
+DESCENT = 0.3
+PADDING = 1.0
+SESSIONS_FILENAME = 'censor_sessions.json'
+
+def page_size(page):
+    return float(page.mediabox.width), float(page.mediabox.height)
+
+def extract_lines(page):
+    """
+    The text lines of a PyPDF2 page with their position, top to bottom, as
+    (text, x, baseline_y, font_size, estimated_end_x) in PDF points, or None if the positions cannot be told.
+    PyPDF2 reports a run of text with the position of the operator that ends it, often the Td moving to the
+    next line, so the position of every text-showing operator is tracked here instead, and a run is placed
+    where its first operator drew. Runs drawn on several lines at once are the ones that cannot be placed.
+    """
+    fragments = []
+    shows = []
+    state = {'leading': 0.0, 'font_size': 0.0, 'ambiguous': False}
+
+    def position(cm, tm, y_offset=0.0):
+        # Text space to user space: the text matrix followed by the current transformation matrix
+        tx, ty = tm[4], tm[5] + y_offset
+        x = tx * cm[0] + ty * cm[2] + cm[4]
+        y = tx * cm[1] + ty * cm[3] + cm[5]
+        size = abs(state['font_size'] * tm[3] * cm[3]) or state['font_size'] or 10
+        return x, y, size
+
+    def operand_visitor(operator, operands, cm, tm):
+        if operator == b'TL':
+            state['leading'] = float(operands[0])
+        elif operator == b'TD':
+            state['leading'] = -float(operands[1])
+        elif operator == b'Tf':
+            state['font_size'] = float(operands[1])
+        elif operator in (b'Tj', b'TJ'):
+            shows.append(position(cm, tm))
+        elif operator in (b"'", b'"'):
+            # These move to the next line before drawing
+            shows.append(position(cm, tm, -state['leading']))
+
+    def text_visitor(text, cm, tm, font_dict, font_size):
+        drawn_at = shows[:]
+        shows.clear()
+        if not text.strip():
+            return
+        if not drawn_at:
+            drawn_at = [position(cm, tm)]
+        x, y, size = drawn_at[0]
+        if any(abs(other_y - y) >= 0.5 * max(size, other_size) for _, other_y, other_size in drawn_at):
+            state['ambiguous'] = True
+        fragments.append((x, y, size, text.strip()))
+
+    page.extract_text(visitor_operand_before=operand_visitor, visitor_text=text_visitor)
+    if state['ambiguous']:
+        return None
+
+    lines = []
+    for x, y, size, text in sorted(fragments, key=lambda fragment: (-fragment[1], fragment[0])):
+        line = lines[-1] if lines else None
+        if line is not None and abs(line['y'] - y) < 0.5 * max(line['size'], size):
+            line['fragments'].append((x, text))
+            line['size'] = max(line['size'], size)
+            line['end'] = max(line['end'], x + len(text) * CHAR_WIDTH * size)
+        else:
+            lines.append({'y': y, 'size': size, 'fragments': [(x, text)], 'end': x + len(text) * CHAR_WIDTH * size})
+    return [(' '.join(text for _, text in sorted(line['fragments'])), min(x for x, _ in line['fragments']),
+             line['y'], line['size'], line['end']) for line in lines]
+
+def parse_amount_cents(amount):
+    """Cents of an amount from selected_transactions.csv ('12.50', '$1,012.50'), or None"""
+    try:
+        return round(float(str(amount).replace('$', '').replace(',', '').strip()) * 100)
+    except ValueError:
+        return None
+
+def transaction_rows(lines):
+    """(date, posting date, amount) of the transactions parsed out of statement <lines>, in order"""
+    return [(row[2], row[3], row[4], row[5], row[6]) for row in parse_page(lines)]
+
+def transaction_boxes(page, selected):
+    """
+    Black boxes over every transaction row of a statement page except the <selected> ones, found from the
+    text positions of the page. <selected> are rows of selected_transactions.csv (date MM-DD and amount).
+    Dated lines that do not parse as a transaction are covered too.
+    Returns (boxes, missing): boxes as (x, y, width, height) in PDF points, and the selected transactions
+    that could not be found on the page. boxes is None, with every selected transaction missing, when the
+    positioned lines do not give the transactions of the plain text extraction, so that the page is reviewed.
+    """
+    lines = extract_lines(page)
+    if lines is None or transaction_rows([line[0] for line in lines]) != transaction_rows(page.extract_text().split('\n')):
+        return None, list(selected)
+    rows = list(parse_page([line[0] for line in lines]))
+    covered_lines = {i for row in rows for i in range(row[0], row[1] + 1)}
+    stray_lines = [i for i, line in enumerate(lines) if i not in covered_lines and DATE_REGEX.search(line[0])]
+    if not rows and not stray_lines:
+        return [], list(selected)
+
+    # Match on date and amount. An amount edited when selecting only leaves the date to go by,
+    # which is used if it is unique on the page
+    kept = set()
+    missing = []
+    for transaction in selected:
+        month, day = (int(part) for part in transaction['date'].split('-'))
+        same_date = [i for i, row in enumerate(rows) if (row[2], row[3]) == (month, day)]
+        exact = [i for i in same_date if rows[i][6] == parse_amount_cents(transaction['amount'])]
+        if exact:
+            kept.update(exact)
+        elif len(same_date) == 1:
+            kept.add(same_date[0])
+        else:
+            missing.append(transaction)
+
+    spans = [(first_line, last_line) for i, (first_line, last_line, *_) in enumerate(rows) if i not in kept]
+    spans += [(i, i) for i in stray_lines]
+    page_width, _ = page_size(page)
+    covered = [lines[i] for i in covered_lines | set(stray_lines)]
+    left = max(0.0, min(line[1] for line in covered) - PADDING)
+    right = min(page_width, max(line[4] for line in covered) + PADDING)
+    boxes = []
+    for first_line, last_line in sorted(spans):
+        top = lines[first_line][2] + ASCENT * lines[first_line][3] + PADDING
+        bottom = lines[last_line][2] - DESCENT * lines[last_line][3] - PADDING
+        boxes.append((left, bottom, right - left, top - bottom))
+    return boxes, missing
+
+def write_censored_pdf(pdf_path, boxes, page_num=0):
+    """
+    Writes page <page_num> of <pdf_path> with black <boxes> ((x, y, width, height) in PDF points) drawn
+    over it to <pdf_path>-censored.pdf, as a vector overlay. Returns the output path
+    """
+    page = PdfReader(pdf_path).pages[page_num]
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=page_size(page))
+    can.setFillColor("black")
+    for x, y, width, height in boxes:
+        can.rect(x, y, width, height, fill=1)
+    can.save()
+    packet.seek(0)
+    page.merge_page(PdfReader(packet).pages[0])
+
+    writer = PdfWriter()
+    writer.add_page(page)
+    output_path = pdf_path.replace(".pdf", "-censored.pdf")
+    with open(output_path, "wb") as f:
+        writer.write(f)
+    return output_path
+
+def auto_censor_pdf(pdf_path, selected, page_num=0):
+    """
+    Censors every transaction of page <page_num> of <pdf_path> except the <selected> ones, without a GUI.
+    Returns (output_path, missing) like transaction_boxes; output_path is None if the page was not written
+    """
+    page = PdfReader(pdf_path).pages[page_num]
+    boxes, missing = transaction_boxes(page, selected)
+    if boxes is None:
+        return None, missing
+    return write_censored_pdf(pdf_path, boxes, page_num), missing
+
+class CensorSessions:
+    """
+    The boxes censoring every statement page, saved to a JSON sidecar in the expense report directory.
+    Pages are keyed by the sha256 of their statement and the page number, and remember the transactions
+    that were left visible, so that a page can be censored again without the GUI as long as neither changed.
+    """
+    def __init__(self, directory):
+        self.path = os.path.join(directory, SESSIONS_FILENAME)
+        self.hashes = {}
+        self.sessions = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as file:
+                    self.sessions = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Could not read the censor sessions, starting over: {e}")
+
+    def key(self, file_path, page):
+        if file_path not in self.hashes:
+            self.hashes[file_path] = file_hash(file_path)
+        return f"{self.hashes[file_path]}:{page}"
+
+    @staticmethod
+    def selection(transactions):
+        return sorted([transaction['date'], str(parse_amount_cents(transaction['amount']))] for transaction in transactions)
+
+    def boxes(self, file_path, page, transactions):
+        """The saved boxes of the page if it was censored with the same <transactions> left visible, else None"""
+        session = self.sessions.get(self.key(file_path, page))
+        if session is None or session['selection'] != self.selection(transactions):
+            return None
+        return [tuple(box) for box in session['boxes']]
+
+    def put(self, file_path, page, transactions, boxes):
+        self.sessions[self.key(file_path, page)] = {
+            'file': file_path,
+            'page': int(page),
+            'selection': self.selection(transactions),
+            'boxes': [list(box) for box in boxes],
+        }
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.sessions, file, indent=2)
+        os.replace(temp_path, self.path)
+
+def selected_on_page(csv_file, pdf_path, page_num=0):
+    """
+    The rows of <csv_file> on page <page_num> of <pdf_path>, which is either the statement itself or one of
+    the <statement>_<page>.pdf copies made for the report
+    """
+    pdf_path = os.path.abspath(pdf_path)
+    with open(csv_file, 'r') as csvfile:
+        return [row for row in csv.DictReader(csvfile)
+                if (os.path.abspath(row['file']) == pdf_path and int(row['page']) == page_num + 1)
+                or f"{os.path.basename(row['file'])}_{row['page']}.pdf" == os.path.basename(pdf_path)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Censor all transactions of a statement page except the selected ones.")
+    parser.add_argument("pdf", help="Statement page to censor")
+    parser.add_argument("csv_file", help="selected_transactions.csv with the transactions to keep visible")
+    parser.add_argument("--page", type=int, default=1, help="Page of the pdf to censor (default: 1)")
+    args = parser.parse_args()
+
+    selected = selected_on_page(args.csv_file, args.pdf, args.page - 1)
+    output_path, missing = auto_censor_pdf(args.pdf, selected, args.page - 1)
+    if output_path is None:
+        print("Could not place the boxes from the text of the page; censor it with the GUI", file=sys.stderr)
+        sys.exit(1)
+    print(f"PDF saved as: {output_path}")
+    for transaction in missing:
+        print(f"Not found on the page: {transaction['date']} ${transaction['amount']}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
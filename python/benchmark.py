@@ -0,0 +1,236 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from PIL import Image, ImageDraw
+from PyPDF2 import PdfReader, PdfWriter
+from create_expense import ScriptState, scan_pdfs, convert_pdfs_to_jpegs
+from python.add_transactions import TransactionFinder
+from python.custom_transactions import TmpFiles, copy_unique_pairs_to_directory
+from python.insert_into_pdf import insert_texts_and_images_to_pdf
+from python.combine_docs import create_combined_pdf
+from python.page_cache import CACHE_FILENAME
+from python.synthetic_statements import generate_archive
+from python.raster_cache import RENDER_MODES, DEFAULT_RENDER_MODE, DEFAULT_RASTER_WORKERS, set_raster_workers
+
+SEARCH_STRING = 'PIZZAIOLO'
+MAX_PAGES_TO_COPY = 20
+JPEG_DPI = 300
+
+def time_stage(function, repeat, setup=None):
+    """Runs <function> <repeat> times, after <setup> if given, with its output silenced. Returns the timings"""
+    runs = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            function()
+            runs.append(time.perf_counter() - start)
+    return {'runs': runs, 'min': min(runs), 'median': statistics.median(runs)}
+
+def reset_directory(directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+def write_form(path):
+    """A letter-size stand-in for the reimbursement form"""
+    pdf = canvas.Canvas(path, pagesize=letter)
+    width, height = letter
+    for y in range(60, int(height) - 60, 18):
+        pdf.line(40, y, width - 40, y)
+    pdf.drawString(40, height - 40, "Expense reimbursement form")
+    pdf.save()
+
+def write_signature(path):
+    image = Image.new('RGBA', (600, 200), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(image)
+    draw.line([(20, 150), (200, 40), (320, 160), (580, 60)], fill=(0, 0, 0, 255), width=6)
+    image.save(path)
+
+def combine_pages(file_paths, output_path):
+    writer = PdfWriter()
+    for file_path in file_paths:
+        for page in PdfReader(file_path).pages:
+            writer.add_page(page)
+    with open(output_path, 'wb') as output_file:
+        writer.write(output_file)
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(work_dir, years=1, accounts=2, transactions_per_page=30, pages_per_statement=2,
+                   repeat=3, workers=1, seed=0, render_mode=DEFAULT_RENDER_MODE, raster_workers=DEFAULT_RASTER_WORKERS):
+    """
+    Generates a synthetic archive in <work_dir> and times every stage of the report pipeline on it.
+    Returns a JSON-serializable dict; stages that need a missing tool are reported as skipped.
+    """
+    estatements_dir = os.path.join(work_dir, 'estatements')
+    reset_directory(estatements_dir)
+    start = time.perf_counter()
+    file_paths, transactions = generate_archive(estatements_dir, years, accounts, transactions_per_page,
+                                                pages_per_statement, seed=seed)
+    generation_seconds = time.perf_counter() - start
+
+    stages = {}
+    set_raster_workers(raster_workers)
+    state = ScriptState()
+    state.workers = workers
+    cache_path = os.path.join(estatements_dir, CACHE_FILENAME)
+
+    # Text search
+    stages['scan_pdfs_cold'] = time_stage(
+        lambda: scan_pdfs(state, estatements_dir, SEARCH_STRING), repeat,
+        setup=lambda: os.path.exists(cache_path) and os.remove(cache_path))
+    stages['scan_pdfs_warm'] = time_stage(lambda: scan_pdfs(state, estatements_dir, SEARCH_STRING), repeat)
+    stages['find_transactions_cold_index'] = time_stage(
+        lambda: TransactionFinder(estatements_dir, workers=workers).find_transactions(SEARCH_STRING), repeat)
+    finder = TransactionFinder(estatements_dir, workers=workers)
+    records = finder.find_transactions(SEARCH_STRING)
+    stages['find_transactions_warm_index'] = time_stage(lambda: finder.find_transactions(SEARCH_STRING), repeat)
+    stages['find_transactions_date'] = time_stage(lambda: finder.find_transactions('03-14'), repeat)
+
+    # Statement pages
+    pairs = sorted({(record.file, str(record.page)) for record in records})[:MAX_PAGES_TO_COPY]
+    pages_dir = os.path.join(work_dir, 'pages')
+    stages['copy_unique_pairs_to_directory'] = time_stage(
+        lambda: copy_unique_pairs_to_directory(pairs, pages_dir), repeat, setup=lambda: reset_directory(pages_dir))
+    page_files = sorted(os.path.join(pages_dir, name) for name in os.listdir(pages_dir))
+
+    # Reimbursement form
+    form_dir = os.path.join(work_dir, 'form')
+    reset_directory(form_dir)
+    form_path = os.path.join(form_dir, 'form.pdf')
+    signature_path = os.path.join(form_dir, 'signature.png')
+    application_path = os.path.join(form_dir, 'application.pdf')
+    write_form(form_path)
+    write_signature(signature_path)
+    texts = [(60 + 18 * i, 100 + 150 * (i % 3), f"Item {i}: ${i * 3}.50", 'Helvetica', 10) for i in range(40)]
+    images = [(300, 500, signature_path, 120, 40)]
+    stages['insert_into_pdf'] = time_stage(
+        lambda: insert_texts_and_images_to_pdf(form_path, application_path, texts, images), repeat)
+
+    # Final report
+    if shutil.which('pdflatex') is None:
+        stages['create_combined_pdf'] = {'skipped': "pdflatex not found"}
+    else:
+        report_dir = os.path.join(work_dir, 'report', 'benchmark_report')
+        tmpfiles = TmpFiles()
+        tmpfiles.ordering_and_descriptions_file = os.path.join(work_dir, 'report', tmpfiles.ordering_and_descriptions_file)
+
+        def prepare_report():
+            reset_directory(os.path.join(report_dir, 'creditcards'))
+            shutil.copy(application_path, os.path.join(report_dir, tmpfiles.application_file))
+            combine_pages(page_files, os.path.join(report_dir, 'creditcards', tmpfiles.combined_creditcards_filename))
+            receipts = []
+            for i, page_file in enumerate(page_files[:5]):
+                receipts.append(f"receipt-{i}.pdf")
+                shutil.copy(page_file, os.path.join(report_dir, receipts[-1]))
+            with open(tmpfiles.ordering_and_descriptions_file, 'w') as file:
+                file.write('\n'.join(receipts) + '\n')
+                file.write("%Latex Begin\n\\documentclass{article}\n\\begin{document}\nBenchmark report.\n\\end{document}\n")
+
+        stages['create_combined_pdf'] = time_stage(lambda: create_combined_pdf(report_dir, tmpfiles), repeat,
+                                                   setup=prepare_report)
+
+    # Pages to censor
+    if shutil.which('pdftoppm') is None:
+        stages['convert_pdfs_to_jpegs'] = {'skipped': "pdftoppm not found"}
+    else:
+        jpeg_dir = os.path.join(work_dir, 'jpegs')
+
+        def prepare_jpegs():
+            reset_directory(jpeg_dir)
+            for page_file in page_files:
+                shutil.copy(page_file, jpeg_dir)
+
+        stages['convert_pdfs_to_jpegs'] = time_stage(lambda: convert_pdfs_to_jpegs(jpeg_dir, JPEG_DPI, render_mode), repeat,
+                                                     setup=prepare_jpegs)
+
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'years': years, 'accounts': accounts, 'transactions_per_page': transactions_per_page,
+            'pages_per_statement': pages_per_statement, 'repeat': repeat, 'workers': workers, 'seed': seed,
+            'render_mode': render_mode, 'raster_workers': raster_workers,
+        },
+        'archive': {
+            'statements': len(file_paths),
+            'pages': len(file_paths) * pages_per_statement,
+            'transactions': transactions,
+            'matches': len(records),
+            'pages_copied': len(page_files),
+            'generation_seconds': generation_seconds,
+        },
+        'stages': stages,
+    }
+
+def compare_results(baseline, results):
+    """Prints the best time of every stage next to the one of <baseline>"""
+    print(f"{'stage':<32}{'baseline':>10}{'current':>10}{'ratio':>8}", file=sys.stderr)
+    for stage, timings in results['stages'].items():
+        old = baseline.get('stages', {}).get(stage, {})
+        if 'min' not in timings or 'min' not in old:
+            print(f"{stage:<32}{'-':>10}{'-':>10}{'-':>8}", file=sys.stderr)
+            continue
+        ratio = timings['min'] / old['min'] if old['min'] else float('inf')
+        print(f"{stage:<32}{old['min']:>10.3f}{timings['min']:>10.3f}{ratio:>8.2f}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the report pipeline on a synthetic eStatements archive.")
+    parser.add_argument("--years", type=int, default=1, help="Years of statements to generate")
+    parser.add_argument("--accounts", type=int, default=2, help="Number of accounts (credit card and chequing alternate)")
+    parser.add_argument("--transactions-per-page", type=int, default=30, help="Transactions on every statement page")
+    parser.add_argument("--pages", type=int, default=2, help="Pages per statement")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every stage")
+    parser.add_argument("--workers", type=int, default=1, help="Number of workers used to extract statement text")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated statements")
+    parser.add_argument("--render-mode", choices=list(RENDER_MODES), default=DEFAULT_RENDER_MODE,
+                        help="Colors of the pages rendered by the JPEG conversion stage")
+    parser.add_argument("--raster-workers", type=int, default=DEFAULT_RASTER_WORKERS,
+                        help="Number of pages rendered at once by the JPEG conversion stage")
+    parser.add_argument("--work-dir", help="Directory for the generated files (default: a temporary one)")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='expense_benchmark_')
+    try:
+        results = run_benchmarks(work_dir, args.years, args.accounts, args.transactions_per_page, args.pages,
+                                 args.repeat, args.workers, args.seed, args.render_mode,
+                                 args.raster_workers)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results saved to {args.output}", file=sys.stderr)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare_results(json.load(file), results)
+
+if __name__ == "__main__":
+    main()
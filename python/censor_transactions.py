@@ -1,13 +1,12 @@
 import tkinter as tk
-from tkinter import ttk
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from pdf2image import convert_from_path
-from PIL import Image, ImageTk, ImageDraw
+from tkinter import ttk, messagebox
+from PIL import Image, ImageDraw
 from PyPDF2 import PdfReader, PdfWriter, PageObject, PdfMerger
 import os
 import sys
-import io
+from python.raster_cache import shared_raster_cache, shared_raster_pool, RENDER_MODES, DEFAULT_RENDER_MODE
+from python.tiled_view import TiledImageView
+from python.auto_censor import page_size, write_censored_pdf
 
 class ImageViewer:
     """
@@ -21,8 +20,6 @@ class ImageViewer:
 
         # Load the image
         self.original_image = Image.open(image_path)
-        self.working_image = self.original_image.copy()
-        self.image = ImageTk.PhotoImage(self.working_image)
 
         # Create frame for canvas and scrollbars
         self.frame = ttk.Frame(self.master)
@@ -38,22 +35,23 @@ class ImageViewer:
         self.h_scrollbar = ttk.Scrollbar(self.master, orient=tk.HORIZONTAL, command=self.canvas.xview)
         self.h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
 
-        self.canvas.configure(yscrollcommand=self.v_scrollbar.set, xscrollcommand=self.h_scrollbar.set)
-
-        # Display image on canvas
-        self.image_on_canvas = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.image)
+        # Display the image on the canvas, only rendering the visible part of it
+        self.view = TiledImageView(self.canvas, self.original_image)
+        self.view.attach_scrollbars(self.v_scrollbar, self.h_scrollbar)
+        self.view.refresh()
 
         # Zoom variables
         self.zoom_factor = 1.0
         self.min_zoom = 0.1
         self.max_zoom = 5.0
-        self.previous_zoom_factor = 1.0
 
         # Rectangle variables
         self.start_x = None
         self.start_y = None
         self.rect = None
         self.rectangles = []
+        self.rectangle_items = []
+        self.undone_rectangles = []
 
         # Bind events
         self.canvas.bind("<ButtonPress-1>", self.on_press)
@@ -62,6 +60,7 @@ class ImageViewer:
         self.canvas.bind("<MouseWheel>", self.on_mousewheel)
         self.master.bind("<Control-MouseWheel>", self.on_ctrl_mousewheel)
         self.master.bind("<Control-z>", self.undo_last_rectangle)
+        self.master.bind("<Control-y>", self.redo_rectangle)
         self.master.bind("<Control-s>", self.save_and_exit)
 
         # Create buttons
@@ -77,6 +76,9 @@ class ImageViewer:
         undo_button = ttk.Button(button_frame, text="Undo", command=self.undo_last_rectangle)
         undo_button.pack(side=tk.LEFT, padx=5, pady=5)
 
+        redo_button = ttk.Button(button_frame, text="Redo", command=self.redo_rectangle)
+        redo_button.pack(side=tk.LEFT, padx=5, pady=5)
+
         save_button = ttk.Button(button_frame, text="Save and Exit", command=self.save_and_exit)
         save_button.pack(side=tk.LEFT, padx=5, pady=5)
 
@@ -119,20 +121,22 @@ class ImageViewer:
     def add_black_rectangle(self, x1, y1, x2, y2):
         x1, y1 = self.canvas_to_image(x1, y1)
         x2, y2 = self.canvas_to_image(x2, y2)
-        
-        draw = ImageDraw.Draw(self.working_image)
-        draw.rectangle([x1, y1, x2, y2], fill="black")
+
+        # Drawn as a canvas item over the page; only burnt into the output when saving
         self.rectangles.append((x1, y1, x2, y2))
-        self.update_image()
+        self.rectangle_items.append(self.view.add_overlay((x1, y1, x2, y2)))
+        self.undone_rectangles = []
 
     def undo_last_rectangle(self, event=None):
         if self.rectangles:
-            self.rectangles.pop()
-            self.working_image = self.original_image.copy()
-            draw = ImageDraw.Draw(self.working_image)
-            for rect in self.rectangles:
-                draw.rectangle(rect, fill="black")
-            self.update_image()
+            self.undone_rectangles.append(self.rectangles.pop())
+            self.view.remove_overlay(self.rectangle_items.pop())
+
+    def redo_rectangle(self, event=None):
+        if self.undone_rectangles:
+            rect = self.undone_rectangles.pop()
+            self.rectangles.append(rect)
+            self.rectangle_items.append(self.view.add_overlay(rect))
 
     def on_mousewheel(self, event):
         x = self.canvas.canvasx(event.x)
@@ -163,35 +167,19 @@ class ImageViewer:
         self.update_image(current_x, current_y)
 
     def update_image(self, focus_x=None, focus_y=None):
-        new_width = int(self.working_image.width * self.zoom_factor)
-        new_height = int(self.working_image.height * self.zoom_factor)
-        resized_image = self.working_image.resize((new_width, new_height), Image.LANCZOS)
-        self.image = ImageTk.PhotoImage(resized_image)
-        
-        if focus_x is None or focus_y is None:
-            self.canvas.coords(self.image_on_canvas, 0, 0)
-        else:
-            current_x, current_y = self.canvas.coords(self.image_on_canvas)
-            delta_x = (focus_x - current_x) * (1 - self.zoom_factor / self.previous_zoom_factor)
-            delta_y = (focus_y - current_y) * (1 - self.zoom_factor / self.previous_zoom_factor)
-            new_x = current_x - delta_x
-            new_y = current_y - delta_y
-            self.canvas.coords(self.image_on_canvas, new_x, new_y)
-        
-        self.canvas.itemconfig(self.image_on_canvas, image=self.image)
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        self.previous_zoom_factor = self.zoom_factor
+        self.view.set_zoom(self.zoom_factor, focus_x, focus_y)
 
     def canvas_to_image(self, x, y):
-        canvas_x, canvas_y = self.canvas.coords(self.image_on_canvas)
-        image_x = int((x - canvas_x) / self.zoom_factor)
-        image_y = int((y - canvas_y) / self.zoom_factor)
-        return image_x, image_y
+        return self.view.canvas_to_image(x, y)
 
     def save_image(self, event=None):
         file_name, file_extension = os.path.splitext(self.image_path)
         output_path = f"{file_name}-censored{file_extension}"
-        self.working_image.save(output_path)
+        censored_image = self.original_image.copy()
+        draw = ImageDraw.Draw(censored_image)
+        for rect in self.rectangles:
+            draw.rectangle(rect, fill="black")
+        censored_image.save(output_path)
         print(f"Image saved as: {output_path}")
 
     def save_and_exit(self):
@@ -199,11 +187,17 @@ class ImageViewer:
         self.master.quit()
 
 class PDFViewer:
-    def __init__(self, master, pdf_path):
+    """
+    A class to censor the transactions of the first page of a pdf. <boxes> ((x, y, width, height) in PDF points)
+    are placed as rectangles when it opens, for review. The page is shown in <render_mode> (see RENDER_MODES)
+    """
+    def __init__(self, master, pdf_path, boxes=None, render_mode=DEFAULT_RENDER_MODE):
         self.master = master
         self.master.title("PDF Viewer")
 
         self.pdf_path = pdf_path
+        self.render_mode = render_mode
+        self.saved_boxes = None
         self.reader = PdfReader(pdf_path)
         self.writer = PdfWriter()
 
@@ -221,8 +215,6 @@ class PDFViewer:
         self.h_scrollbar = ttk.Scrollbar(self.master, orient=tk.HORIZONTAL, command=self.canvas.xview)
         self.h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
 
-        self.canvas.configure(yscrollcommand=self.v_scrollbar.set, xscrollcommand=self.h_scrollbar.set)
-
         # Load the first page
         self.page_num = 0
         self.load_page(self.page_num)
@@ -234,6 +226,7 @@ class PDFViewer:
         self.canvas.bind("<MouseWheel>", self.on_mousewheel)
         self.master.bind("<Control-MouseWheel>", self.on_ctrl_mousewheel)
         self.master.bind("<Control-z>", self.undo_last_rectangle)
+        self.master.bind("<Control-y>", self.redo_rectangle)
         self.master.bind("<Control-s>", self.save_and_exit)
 
         # Create buttons
@@ -243,7 +236,6 @@ class PDFViewer:
         self.min_zoom = 0.1
         self.max_zoom = 5.0
         self.zoom_factor = 1.0
-        self.previous_zoom_factor = 1.0
         self.create_zoom_bar()
 
         # Rectangle variables
@@ -251,6 +243,17 @@ class PDFViewer:
         self.start_y = None
         self.rect = None
         self.rectangles = []
+        self.rectangle_items = []
+        self.undone_rectangles = []
+        self.place_boxes(boxes or [])
+
+    def place_boxes(self, boxes):
+        """Adds rectangles over <boxes> ((x, y, width, height) in PDF points)"""
+        for x, y, width, height in boxes:
+            x1, y1 = self.pdf_to_image(x, y + height)
+            x2, y2 = self.pdf_to_image(x + width, y)
+            self.rectangles.append((x1, y1, x2, y2))
+            self.rectangle_items.append(self.view.add_overlay((x1, y1, x2, y2)))
 
     def create_buttons(self):
         button_frame = ttk.Frame(self.master)
@@ -259,6 +262,9 @@ class PDFViewer:
         undo_button = ttk.Button(button_frame, text="Undo", command=self.undo_last_rectangle)
         undo_button.pack(side=tk.LEFT, padx=5, pady=5)
 
+        redo_button = ttk.Button(button_frame, text="Redo", command=self.redo_rectangle)
+        redo_button.pack(side=tk.LEFT, padx=5, pady=5)
+
         save_button = ttk.Button(button_frame, text="Save and Exit", command=self.save_and_exit)
         save_button.pack(side=tk.LEFT, padx=5, pady=5)
 
@@ -275,12 +281,11 @@ class PDFViewer:
         self.zoom_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
     def load_page(self, page_num):
-        images = convert_from_path(self.pdf_path, first_page=page_num + 1, last_page=page_num + 1)
-        self.image = images[0]
-        self.working_image = self.image.copy()
-        self.tk_image = ImageTk.PhotoImage(self.image)
-        self.image_on_canvas = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_image)
-        self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL))
+        self.image = shared_raster_cache().render_page(self.pdf_path, page_num + 1,
+                                                      colorspace=RENDER_MODES[self.render_mode])
+        self.view = TiledImageView(self.canvas, self.image)
+        self.view.attach_scrollbars(self.v_scrollbar, self.h_scrollbar)
+        self.view.refresh()
 
     def on_press(self, event):
         self.start_x = self.canvas.canvasx(event.x)
@@ -309,20 +314,22 @@ class PDFViewer:
     def add_black_rectangle(self, x1, y1, x2, y2):
         x1, y1 = self.canvas_to_image(x1, y1)
         x2, y2 = self.canvas_to_image(x2, y2)
-        
-        draw = ImageDraw.Draw(self.working_image)
-        draw.rectangle([x1, y1, x2, y2], fill="black")
+
+        # Drawn as a canvas item over the page; only burnt into the output when saving
         self.rectangles.append((x1, y1, x2, y2))
-        self.update_image()
+        self.rectangle_items.append(self.view.add_overlay((x1, y1, x2, y2)))
+        self.undone_rectangles = []
 
     def undo_last_rectangle(self, event=None):
         if self.rectangles:
-            self.rectangles.pop()
-            self.working_image = self.image.copy()
-            draw = ImageDraw.Draw(self.working_image)
-            for rect in self.rectangles:
-                draw.rectangle(rect, fill="black")
-            self.update_image()
+            self.undone_rectangles.append(self.rectangles.pop())
+            self.view.remove_overlay(self.rectangle_items.pop())
+
+    def redo_rectangle(self, event=None):
+        if self.undone_rectangles:
+            rect = self.undone_rectangles.pop()
+            self.rectangles.append(rect)
+            self.rectangle_items.append(self.view.add_overlay(rect))
 
     def on_mousewheel(self, event):
         x = self.canvas.canvasx(event.x)
@@ -353,55 +360,26 @@ class PDFViewer:
         self.update_image(current_x, current_y)
 
     def update_image(self, focus_x=None, focus_y=None):
-        new_width = int(self.working_image.width * self.zoom_factor)
-        new_height = int(self.working_image.height * self.zoom_factor)
-        resized_image = self.working_image.resize((new_width, new_height), Image.LANCZOS)
-        self.tk_image = ImageTk.PhotoImage(resized_image)
-        
-        if focus_x is None or focus_y is None:
-            self.canvas.coords(self.image_on_canvas, 0, 0)
-        else:
-            current_x, current_y = self.canvas.coords(self.image_on_canvas)
-            delta_x = (focus_x - current_x) * (1 - self.zoom_factor / self.previous_zoom_factor)
-            delta_y = (focus_y - current_y) * (1 - self.zoom_factor / self.previous_zoom_factor)
-            new_x = current_x - delta_x
-            new_y = current_y - delta_y
-            self.canvas.coords(self.image_on_canvas, new_x, new_y)
-        
-        self.canvas.itemconfig(self.image_on_canvas, image=self.tk_image)
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
-        self.previous_zoom_factor = self.zoom_factor
+        self.view.set_zoom(self.zoom_factor, focus_x, focus_y)
 
     def canvas_to_image(self, x, y):
-        canvas_x, canvas_y = self.canvas.coords(self.image_on_canvas)
-        image_x = int((x - canvas_x) / self.zoom_factor)
-        image_y = int((y - canvas_y) / self.zoom_factor)
-        return image_x, image_y
+        return self.view.canvas_to_image(x, y)
 
-    def save_and_exit(self):
-        page = self.reader.pages[self.page_num]
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=letter)
-    
+    def pdf_boxes(self):
+        """The rectangles as (x, y, width, height) in PDF points"""
+        boxes = []
         for rect in self.rectangles:
             x1, y1, x2, y2 = rect
             # Convert canvas coordinates to PDF coordinates
             x1_pdf, y1_pdf = self.image_to_pdf(x1, y1)
             x2_pdf, y2_pdf = self.image_to_pdf(x2, y2)
-            can.setFillColor("black")
-            pdf_width, pdf_height = letter  # Define pdf_height here
-            can.rect(x1_pdf, y2_pdf, x2_pdf - x1_pdf, y1_pdf - y2_pdf, fill=1)
-        
-        can.save()
-        packet.seek(0)
-        overlay_pdf = PdfReader(packet)
-        overlay_page = overlay_pdf.pages[0]
-        page.merge_page(overlay_page)
-        
-        self.writer.add_page(page)
-        output_path = self.pdf_path.replace(".pdf", "-censored.pdf")
-        with open(output_path, "wb") as f:
-            self.writer.write(f)
+            boxes.append((x1_pdf, y2_pdf, x2_pdf - x1_pdf, y1_pdf - y2_pdf))
+        return boxes
+
+    def save_and_exit(self, event=None):
+        boxes = self.pdf_boxes()
+        output_path = write_censored_pdf(self.pdf_path, boxes, self.page_num)
+        self.saved_boxes = boxes
         print(f"PDF saved as: {output_path}")
         self.master.quit()
     
@@ -410,16 +388,142 @@ class PDFViewer:
         Convert canvas coordinates to PDF coordinates
         """
         image_width, image_height = self.image.size
-        pdf_width, pdf_height = letter
+        pdf_width, pdf_height = page_size(self.reader.pages[self.page_num])
         pdf_x = x / image_width * pdf_width
         pdf_y = pdf_height - (y / image_height * pdf_height)
         return pdf_x, pdf_y
 
-def censor_transactions_mainloop(image_path):
+    def pdf_to_image(self, x, y):
+        image_width, image_height = self.image.size
+        pdf_width, pdf_height = page_size(self.reader.pages[self.page_num])
+        return x / pdf_width * image_width, (pdf_height - y) / pdf_height * image_height
+
+class MultiPDFViewer(PDFViewer):
+    """
+    Censors the first pages of several pdfs in a single window, with Previous/Next (Page Up/Page Down) to move
+    between them. <documents> are (pdf_path, boxes, description), <boxes> being pre-placed as in PDFViewer.
+    All pages are rendered ahead on the shared rasterization pool while the user censors, and every page
+    is written when saving. Pages with pre-placed boxes are written with them if they were never opened;
+    saving is refused while a page without any has not been opened.
+    """
+    def __init__(self, master, documents, render_mode=DEFAULT_RENDER_MODE):
+        self.documents = [{'pdf_path': pdf_path, 'boxes': boxes, 'description': description,
+                           'rectangles': None, 'undone': [], 'opened': False}
+                          for pdf_path, boxes, description in documents]
+        self.index = 0
+        self.saved = [None] * len(self.documents)
+        # Submitted in order, so the pool works on the next pages first
+        self.renders = shared_raster_pool().submit_batch([(document['pdf_path'], 1) for document in self.documents],
+                                                         colorspace=RENDER_MODES[render_mode])
+        first = self.documents[0]
+        first['opened'] = True
+        super().__init__(master, first['pdf_path'], first['boxes'], render_mode)
+        self.master.bind("<Prior>", self.previous_document)
+        self.master.bind("<Next>", self.next_document)
+        self.create_navigation()
+
+    def load_page(self, page_num):
+        # Waits for the prefetched rendering if it is not done yet
+        self.image = self.renders[self.index].result()
+        self.view = TiledImageView(self.canvas, self.image)
+        self.view.attach_scrollbars(self.v_scrollbar, self.h_scrollbar)
+        self.view.refresh()
+
+    def create_navigation(self):
+        navigation_frame = ttk.Frame(self.master)
+        navigation_frame.pack(side=tk.BOTTOM, fill=tk.X)
+
+        ttk.Button(navigation_frame, text="Previous", command=self.previous_document).pack(side=tk.LEFT, padx=5, pady=5)
+        self.description_label = ttk.Label(navigation_frame)
+        self.description_label.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        ttk.Button(navigation_frame, text="Next", command=self.next_document).pack(side=tk.RIGHT, padx=5, pady=5)
+        self.update_description()
+
+    def update_description(self):
+        document = self.documents[self.index]
+        self.master.title(f"PDF Viewer - {self.index + 1}/{len(self.documents)} {os.path.basename(document['pdf_path'])}")
+        self.description_label.configure(text=document['description'])
+
+    def leave_document(self):
+        """Keeps the rectangles of the current page, in image and PDF coordinates"""
+        document = self.documents[self.index]
+        document['rectangles'] = self.rectangles
+        document['undone'] = self.undone_rectangles
+        document['boxes'] = self.pdf_boxes()
+
+    def show_document(self, index):
+        if not 0 <= index < len(self.documents) or index == self.index:
+            return
+        self.leave_document()
+        self.view.close()
+        self.index = index
+        document = self.documents[index]
+        self.pdf_path = document['pdf_path']
+        self.reader = PdfReader(self.pdf_path)
+        self.page_num = 0
+        self.load_page(self.page_num)
+
+        self.rect = None
+        self.rectangles = []
+        self.rectangle_items = []
+        if document['opened']:
+            self.undone_rectangles = document['undone']
+            for rect in document['rectangles']:
+                self.rectangles.append(rect)
+                self.rectangle_items.append(self.view.add_overlay(rect))
+        else:
+            document['opened'] = True
+            self.undone_rectangles = []
+            self.place_boxes(document['boxes'] or [])
+        if self.zoom_factor != 1.0:
+            self.view.set_zoom(self.zoom_factor)
+        self.update_description()
+
+    def previous_document(self, event=None):
+        self.show_document(self.index - 1)
+
+    def next_document(self, event=None):
+        self.show_document(self.index + 1)
+
+    def save_and_exit(self, event=None):
+        unchecked = [i for i, document in enumerate(self.documents) if not document['opened'] and not document['boxes']]
+        if unchecked:
+            messagebox.showwarning("Pages left to censor",
+                                   f"{len(unchecked)} page(s) without any box were never opened. "
+                                   "Showing the first one; save again once they are censored.", parent=self.master)
+            self.show_document(unchecked[0])
+            return
+        self.leave_document()
+        for i, document in enumerate(self.documents):
+            output_path = write_censored_pdf(document['pdf_path'], document['boxes'])
+            self.saved[i] = document['boxes']
+            print(f"PDF saved as: {output_path}")
+        self.cancel_prefetch()
+        self.master.quit()
+
+    def cancel_prefetch(self):
+        for render in self.renders:
+            render.cancel()
+
+def censor_transactions_mainloop(image_path, boxes=None, render_mode=DEFAULT_RENDER_MODE):
+    """Opens the censoring GUI. Returns the boxes of the saved pdf in PDF points, or None if it was not saved"""
+    root = tk.Tk()
+    app = PDFViewer(root, image_path, boxes, render_mode)
+    root.mainloop()
+    root.destroy()
+    return app.saved_boxes
+
+def censor_documents_mainloop(documents, render_mode=DEFAULT_RENDER_MODE):
+    """
+    Opens one censoring GUI for all <documents> ((pdf_path, boxes, description), see MultiPDFViewer).
+    Returns the boxes saved for every document, None for those that were not saved
+    """
     root = tk.Tk()
-    app = PDFViewer(root, image_path)
+    app = MultiPDFViewer(root, documents, render_mode)
     root.mainloop()
     root.destroy()
+    app.cancel_prefetch()
+    return app.saved
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -1,12 +1,16 @@
+import io
 import os
 import sys
 import logging
 import subprocess
-from PyPDF2 import PdfMerger, PdfReader, PdfWriter
+from PyPDF2 import PdfReader, PdfWriter
 from PIL import Image
+from python.profiling import profiler
 
 #logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# PDF colorspaces of the JPEGs that can be embedded as they are
+JPEG_COLORSPACES = {'L': '/DeviceGray', 'RGB': '/DeviceRGB', 'CMYK': '/DeviceCMYK'}
 
 def resize_and_rotate_page(page, target_width, target_height, rotate=False):
     logging.debug(f"Original page size: {page.mediabox.width} x {page.mediabox.height}")
@@ -69,35 +73,73 @@ def resize_and_rotate_page(page, target_width, target_height, rotate=False):
 
     return target_width, target_height
 
-def convert_images_to_pdf(file_path, pdf_path, page_width, page_height, dpi=100):
+def image_page_size(image, page_width, page_height, dpi=None):
+    """
+    Page size in points of <image>: from <dpi>, or else from the DPI in the image metadata, or else
+    the largest size with the image's aspect ratio that fits in page_width x page_height
+    """
+    if not dpi:
+        x_dpi, y_dpi = image.info.get('dpi', (0, 0))
+        # JFIF files without units report an aspect ratio of 1 rather than a resolution
+        if x_dpi > 1 and y_dpi > 1:
+            return image.width / float(x_dpi) * 72, image.height / float(y_dpi) * 72
+        scale = min(page_width / image.width, page_height / image.height)
+        return image.width * scale, image.height * scale
+    return image.width / dpi * 72, image.height / dpi * 72
+
+def write_jpeg_pdf(jpeg_data, image, pdf_file, width, height):
+    """
+    Writes a one-page pdf of width x height points showing the JPEG <jpeg_data>, embedded as it is
+    (DCTDecode) rather than decoded and compressed again. <image> is the same JPEG opened by PIL
+    """
+    colorspace = JPEG_COLORSPACES[image.mode]
+    # PIL inverts Adobe CMYK JPEGs when decoding them, and so must the PDF viewer
+    decode = ' /Decode [1 0 1 0 1 0 1 0]' if image.mode == 'CMYK' and 'adobe' in image.info else ''
+    content = f"q {width:.4f} 0 0 {height:.4f} 0 0 cm /Im0 Do Q".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.4f} {height:.4f}] "
+        f"/Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>".encode(),
+        f"<< /Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} /ColorSpace {colorspace} "
+        f"/BitsPerComponent 8 /Filter /DCTDecode{decode} /Length {len(jpeg_data)} >>\nstream\n".encode()
+        + jpeg_data + b"\nendstream",
+        f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream",
+    ]
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+
+    if hasattr(pdf_file, 'write'):
+        pdf_file.write(output)
+    else:
+        with open(pdf_file, 'wb') as file:
+            file.write(output)
+
+def convert_images_to_pdf(file_path, pdf_path, page_width, page_height, dpi=None):
+    """
+    Writes the image <file_path> as a one-page pdf to <pdf_path>, a path or a binary file object.
+    The page size comes from <dpi>, the DPI metadata of the image, or page_width x page_height (see
+    image_page_size). JPEGs are embedded without being decoded; other images are transcoded by PIL.
+    """
     image = Image.open(file_path)
-    image = image.convert("RGB")
-    # Calculate the new dimensions based on DPI
-    width, height = image.size
-    width_in_points = (width / dpi) * 72
-    height_in_points = (height / dpi) * 72
-    image = image.resize((int(width_in_points), int(height_in_points)), Image.LANCZOS)
-    image.save(pdf_path, dpi=(dpi, dpi))
-
-def add_pdf_to_merger(merger, file_path, width, height, rotate=False):
-    logging.info(f"Processing file: {file_path}")
-    try:
-        reader = PdfReader(file_path)
-        writer = PdfWriter()
-        for page_num in range(len(reader.pages)):
-            page = reader.pages[page_num]
-            resize_and_rotate_page(page, width, height, rotate)
-            writer.add_page(page)
-        temp_path = file_path.replace(".pdf", "_resized.pdf")
-        with open(temp_path, "wb") as temp_file:
-            writer.write(temp_file)
-        merger.append(temp_path)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        logging.info(f"Successfully added {file_path} to merger")
-    except Exception as e:
-        logging.error(f"Error processing {file_path}: {str(e)}")
-        raise
+    width, height = image_page_size(image, page_width, page_height, dpi)
+    if image.format == 'JPEG' and image.mode in JPEG_COLORSPACES:
+        with open(file_path, 'rb') as file:
+            write_jpeg_pdf(file.read(), image, pdf_path, width, height)
+        return
+
+    if image.mode not in ('1', 'L', 'RGB', 'CMYK'):
+        image = image.convert("RGB")
+    # The PDF writer of PIL sizes the page from the resolution, so no resampling is needed
+    image.save(pdf_path, 'PDF', resolution=image.width / width * 72)
 
 def combine_files_to_pdf(directory, output_filename):
     required_files = [
@@ -115,8 +157,9 @@ def combine_files_to_pdf(directory, output_filename):
             logging.error(f"Missing file: {file_path}")
             return
     
-    # Create a PdfMerger object
-    merger = PdfMerger()
+    # Every page is resized in place and added to a single writer, so that nothing is written
+    # to disk but the combined PDF
+    writer = PdfWriter()
     
     # Define standard page size (e.g., letter size 8.5 x 11 inches)
     page_width, page_height = 612, 792  # Points (1 inch = 72 points)
@@ -125,20 +168,21 @@ def combine_files_to_pdf(directory, output_filename):
     for file in ["description.pdf", "application.pdf", "announcement.pdf", "receipt.pdf"]:
         file_path = os.path.join(directory, file)
         rotate = (file == "application.pdf")
-        add_pdf_to_merger(merger, file_path, page_width, page_height, rotate)
+        add_page_to_writer(writer, file_path, page_width, page_height, rotate)
     
-    # Convert JPG to PDF and add
+    # Convert JPG to PDF in memory and add
     for file in ["Signup_sheet.jpg", "creditcard/1-censored.jpg"]:
         file_path = os.path.join(directory, file)
-        pdf_path = file_path.replace(".jpg", ".pdf")
-        convert_images_to_pdf(file_path, pdf_path, page_width, page_height)
-        add_pdf_to_merger(merger, pdf_path, page_width, page_height)
-        os.remove(pdf_path)  # Remove the temporary PDF file
+        pdf_stream = io.BytesIO()
+        convert_images_to_pdf(file_path, pdf_stream, page_width, page_height)
+        pdf_stream.seek(0)
+        add_page_to_writer(writer, pdf_stream, page_width, page_height)
     
     # Write the combined PDF to the output file
     output_path = os.path.join(directory, output_filename)
-    merger.write(output_path)
-    merger.close()
+    with profiler.span("write_report", file=output_path):
+        with open(output_path, 'wb') as output_file:
+            writer.write(output_file)
     logging.info(f"Combined PDF saved as: {output_path}")
 
 def combine_files_to_pdf_with_exceptions(directory, output_filename):
@@ -169,7 +213,8 @@ def compile_tex(tex_path):
     ]
 
     # Execute the command
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    with profiler.span("pdflatex", file=tex_path):
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
 
     # Check if the compilation was successful
     if result.returncode != 0:
@@ -275,13 +320,14 @@ def create_combined_pdf(output_dir, tmpfiles):
     # Save the resulting combined file
     if os.path.exists(output_pdf_path):
         os.remove(output_pdf_path) # Avoid duplicates
-    with open(output_pdf_path, 'wb') as output_file:
-        pdf_writer.write(output_file)
+    with profiler.span("write_report", file=output_pdf_path):
+        with open(output_pdf_path, 'wb') as output_file:
+            pdf_writer.write(output_file)
 
     print(f"Combined PDF saved to: {output_pdf_path}")
 
-# Special function that is only used for application file
 def add_page_to_writer(writer, file_path, width, height, rotate=False):
+    """Resizes every page of <file_path> (a path or a binary file object) to width x height and adds it to <writer>"""
     logging.info(f"Processing file: {file_path}")
     try:
         reader = PdfReader(file_path)
@@ -296,9 +342,10 @@ def add_page_to_writer(writer, file_path, width, height, rotate=False):
 
 def add_pdf_to_writer(pdf_path, pdf_writer):
     try:
-        pdf_reader = PdfReader(pdf_path)
-        for page in pdf_reader.pages:
-            pdf_writer.add_page(page)
+        with profiler.span("append_pdf", file=pdf_path):
+            pdf_reader = PdfReader(pdf_path)
+            for page in pdf_reader.pages:
+                pdf_writer.add_page(page)
         print(f"Added {pdf_path} to the writer.")
     except Exception as e:
         print(f"Error adding {pdf_path}: {e}")
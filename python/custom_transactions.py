@@ -12,9 +12,12 @@ import re
 from PyPDF2 import PdfReader, PdfWriter, PdfMerger
 from python.add_transactions import add_transactions_from_estatements, open_file_in_editor
 from python.insert_into_pdf import insert_into_pdf
-from python.censor_transactions import censor_transactions_mainloop
+from python.censor_transactions import censor_documents_mainloop
+from python.auto_censor import transaction_boxes, write_censored_pdf, CensorSessions
 from python.insert_into_pdf import create_reimbursement_form
 from python.combine_docs import create_combined_pdf
+from python.profiling import profiler
+from python.raster_cache import DEFAULT_RENDER_MODE
 
 class TmpFiles:
     def __init__(self):
@@ -35,36 +38,45 @@ def process_transactions_custom(state, args, config_file):
     # Step 1: Use add_transactions_from_estatements to select transactions and save to CSV
     csv_filename = 'selected_transactions.csv'
     csv_file = os.path.join(args.expense_reports_directory, csv_filename)
-    add_transactions_from_estatements(state, args.estatements_directory, csv_file)
+    with profiler.span("select_transactions", 'stage'):
+        add_transactions_from_estatements(state, args.estatements_directory, csv_file)
 
     # Step 2: Get unique file+page pairs from CSV
-    unique_pairs = get_unique_file_page_pairs(csv_file)
+    with profiler.span("dedupe_pairs", 'stage'):
+        unique_pairs = get_unique_file_page_pairs(csv_file)
 
     # Step 3: Copy unique pairs (file+page) to creditcards directory
     output_dir = create_output_directory(args.expense_reports_directory)
     output_dir = os.path.abspath(output_dir)
     creditcards_dir = os.path.join(output_dir, 'creditcards')
     os.makedirs(creditcards_dir, exist_ok=True)
-    copy_unique_pairs_to_directory(unique_pairs, creditcards_dir)
+    with profiler.span("copy_pages", 'stage'):
+        copy_unique_pairs_to_directory(unique_pairs, creditcards_dir)
 
     # Step 4: User interaction for uncensoring transactions
     transactions = read_transactions_from_csv(csv_file)
     transactions_to_uncensor = get_transactions_to_uncensor(transactions)
-    run_censorer = ask_to_censor_when_file_is_present(creditcards_dir, tmpfiles)
+    run_censorer, replay_sessions = ask_to_censor_when_file_is_present(creditcards_dir, tmpfiles)
     if run_censorer:
-        run_transaction_censorer(creditcards_dir, transactions_to_uncensor)
-        clean_and_combine_pdfs_in_creditcards_dir(creditcards_dir, tmpfiles.combined_creditcards_filename)
+        with profiler.span("censor", 'stage'):
+            sessions = CensorSessions(output_dir)
+            run_transaction_censorer(creditcards_dir, transactions_to_uncensor, state.censor_mode,
+                                     sessions, replay_sessions, state.render_mode)
+            clean_and_combine_pdfs_in_creditcards_dir(creditcards_dir, tmpfiles.combined_creditcards_filename)
 
     # Step 5: Edit the ordering of files to include in the editor of choice
-    pdf_files = list_pdf_files(output_dir, exclude_files = [ tmpfiles.descriptions_file_pdf, tmpfiles.application_file ])
-    write_pdf_list_to_file(pdf_files, output_dir, tmpfiles)
-    open_file_in_editor(state, tmpfiles.ordering_and_descriptions_file)
+    with profiler.span("edit_ordering", 'stage'):
+        pdf_files = list_pdf_files(output_dir, exclude_files = [ tmpfiles.descriptions_file_pdf, tmpfiles.application_file ])
+        write_pdf_list_to_file(pdf_files, output_dir, tmpfiles)
+        open_file_in_editor(state, tmpfiles.ordering_and_descriptions_file)
 
     # Step 6: Create reimbursement form
-    create_reimbursement_form(state, output_dir, config_file, csv_file)
+    with profiler.span("fill_form", 'stage'):
+        create_reimbursement_form(state, output_dir, config_file, csv_file)
 
     # Step 7: Combine selected files into final report
-    create_combined_pdf(output_dir, tmpfiles)
+    with profiler.span("combine", 'stage'):
+        create_combined_pdf(output_dir, tmpfiles)
 
 def list_pdf_files(directory, exclude_files=None):
     # Check if directory exists
@@ -171,12 +183,13 @@ def create_output_directory(expense_reports_directory):
 
 def copy_unique_pairs_to_directory(unique_pairs, target_dir):
     for file_path, page_num in unique_pairs:
-        pdf_reader = PdfReader(file_path)
-        pdf_writer = PdfWriter()
-        pdf_writer.add_page(pdf_reader.pages[int(page_num) - 1])
-        output_filename = f"{os.path.basename(file_path)}_{page_num}.pdf"
-        with open(os.path.join(target_dir, output_filename), "wb") as output_pdf:
-            pdf_writer.write(output_pdf)
+        with profiler.span("copy_page", file=file_path, page=page_num):
+            pdf_reader = PdfReader(file_path)
+            pdf_writer = PdfWriter()
+            pdf_writer.add_page(pdf_reader.pages[int(page_num) - 1])
+            output_filename = f"{os.path.basename(file_path)}_{page_num}.pdf"
+            with open(os.path.join(target_dir, output_filename), "wb") as output_pdf:
+                pdf_writer.write(output_pdf)
 
 def read_transactions_from_csv(csv_filename):
     transactions = []
@@ -195,36 +208,96 @@ def get_transactions_to_uncensor(transactions):
     return transactions
 
 def ask_to_censor_when_file_is_present(creditcards_dir, tmpfiles):
-    """Checks if the censored transactions file exists and asks the user if they want to overwrite it"""
+    """
+    Checks if the censored transactions file exists and asks the user if they want to overwrite it.
+    Returns (run_censorer, replay_sessions): whether to censor the pages again, and whether the pages
+    censored before with the same transactions may be redone from their saved sessions
+    """
     run_censorer = True
+    replay_sessions = True
     full_path = os.path.join( creditcards_dir, tmpfiles.combined_creditcards_filename)
     if os.path.exists(full_path):
-        response = input("Censored transactions file was found. Would you like to use it (y) or redo censoring (n)? Default: y. ")
+        response = input("Censored transactions file was found. Would you like to use it (y), redo censoring "
+                         "of the changed pages only (n), or redo censoring of all pages (a)? Default: y. ")
         if not response:
             response = 'y'
         if response.lower() == 'y':
             run_censorer = False
-    return run_censorer
-
-
-
-def run_transaction_censorer(creditcards_dir, transactions_to_uncensor):
+        elif response.lower() == 'a':
+            replay_sessions = False
+    return run_censorer, replay_sessions
+
+
+
+def run_transaction_censorer(creditcards_dir, transactions_to_uncensor, mode='gui', sessions=None, replay_sessions=True,
+                             render_mode=DEFAULT_RENDER_MODE):
+    """
+    Censors every statement page except the transactions to uncensor. <mode> is 'gui' to draw the boxes by hand,
+    'auto' to place them from the text positions of the page without a GUI, or 'review' to open the GUI
+    with them already placed. Pages on which a transaction could not be found are always opened for review.
+    The boxes of every page are saved to <sessions>; with <replay_sessions>, the pages whose statement and
+    transactions did not change since are censored again from them, without the GUI.
+    The pages that need the GUI are all censored in a single window at the end, shown in <render_mode>.
+    """
     # Group transactions by file and page
     grouped_transactions = defaultdict(list)
     for transaction in transactions_to_uncensor:
         key = (transaction['file'], transaction['page'])
         grouped_transactions[key].append(transaction)
 
-    # Iterate over each group and call the censor_transactions_mainloop function
+    # Censor what can be done without the GUI, and collect the pages that need it
+    gui_pages = []
     for (file, page), transactions in grouped_transactions.items():
         # Construct the PDF path
         pdf_name = f"{os.path.basename(file)}_{page}.pdf"
         pdf_path = os.path.join(creditcards_dir, pdf_name)
 
-        # Display the transactions to the user
+        if sessions is not None and replay_sessions:
+            boxes = sessions.boxes(file, page, transactions)
+            if boxes is not None:
+                with profiler.span("replay_censor_page", file=pdf_path):
+                    output_path = write_censored_pdf(pdf_path, boxes)
+                print(f"PDF saved as: {output_path} (from the saved censoring)")
+                continue
+
+        boxes = None
+        if mode in ('auto', 'review'):
+            with profiler.span("auto_censor_page", file=pdf_path):
+                boxes, missing = transaction_boxes(PdfReader(pdf_path).pages[0], transactions)
+            if boxes is None:
+                print(f"Could not place the boxes from the text of {file} page {page}")
+            elif mode == 'auto' and not missing:
+                output_path = write_censored_pdf(pdf_path, boxes)
+                print(f"PDF saved as: {output_path}")
+                save_censor_session(sessions, file, page, transactions, boxes)
+                continue
+            else:
+                for transaction in missing:
+                    print(f"Could not find the transaction of {transaction['date']} (${transaction['amount']}) on {file} page {page}")
+
+        gui_pages.append((file, page, transactions, pdf_path, boxes))
+
+    if not gui_pages:
+        return
+
+    # Display the transactions to the user
+    documents = []
+    for file, page, transactions, pdf_path, boxes in gui_pages:
         print(f"Please uncensor the following transactions from {file} page {page}:")
         for transaction in transactions:
             print(f"- Date: {transaction['date']}, Amount: ${transaction['amount']}")
-
-        # Call the censor_transactions_mainloop function
-        censor_transactions_mainloop(pdf_path)
+        description = f"{os.path.basename(file)} page {page}, uncensor: " + ', '.join(
+            f"{transaction['date']} ${transaction['amount']}" for transaction in transactions)
+        documents.append((pdf_path, boxes, description))
+
+    # A single window for all pages; they are written when it is saved
+    with profiler.span("censor_pages", pages=len(documents)):
+        saved = censor_documents_mainloop(documents, render_mode)
+    for (file, page, transactions, _, _), saved_boxes in zip(gui_pages, saved):
+        if saved_boxes is not None:
+            save_censor_session(sessions, file, page, transactions, saved_boxes)
+
+def save_censor_session(sessions, file, page, transactions, boxes):
+    if sessions is not None:
+        sessions.put(file, page, transactions, boxes)
+        sessions.save()
@@ -0,0 +1,63 @@
+from collections import deque
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton: finds which of many patterns occur in a text in a single pass
+    over the text, whatever the number of patterns.
+    """
+    def __init__(self, patterns):
+        self.patterns = [pattern for pattern in dict.fromkeys(patterns) if pattern]
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        # Build the trie of the patterns
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.output[state].append(index)
+
+        # Breadth-first pass to set the failure links; every state also outputs the patterns of
+        # the longest suffix that is itself a state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0) if state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def match_indices(self, text):
+        """Returns the set of indices (into self.patterns) of the patterns occurring in <text>"""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found.update(self.output[state])
+        return found
+
+    def matches(self, text):
+        """Returns the patterns occurring in <text>, in the order they were given"""
+        return [self.patterns[index] for index in sorted(self.match_indices(text))]
+
+def read_search_terms(vendors_file):
+    """Reads one search term per line, skipping empty lines and # comments"""
+    with open(vendors_file, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
@@ -0,0 +1,265 @@
+import os
+import sys
+import signal
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from python.text_backends import get_backend, DEFAULT_BACKEND, BACKENDS
+from python.profiling import profiler
+
+CACHE_FILENAME = '.page_text_cache.sqlite'
+# Statements longer than this are split into page ranges when extracted in parallel
+PAGES_PER_TASK = 4
+
+def iter_pdf_files(directory):
+    """Yields the pdf files under <directory> in os.walk order"""
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith('.pdf'):
+                yield os.path.join(root, file)
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+def extract_page_range(backend_name, file_path, first_page, last_page):
+    """Extracts the text of pages [first_page, last_page) of <file_path>. Runs in the pool workers"""
+    return get_backend(backend_name).extract_pages(file_path, first_page, last_page)
+
+def ignore_interrupts():
+    """Lets Ctrl-C reach only the main process, which then cancels the pool"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class PageTextCache:
+    """
+    On-disk cache of the text of every eStatement page, keyed by (path, size, mtime, page).
+    Lives in a SQLite file at the root of the eStatements directory, so that the text of
+    a statement is only extracted again once the file changes (or the text backend does).
+    Without an explicit <backend>, the one saved by `python -m python.text_backends` is used.
+    """
+    def __init__(self, estatements_dir, cache_path=None, debug=False, backend=None):
+        self.estatements_dir = os.path.abspath(estatements_dir)
+        self.cache_path = cache_path or os.path.join(self.estatements_dir, CACHE_FILENAME)
+        self.debug = debug
+        self.connection = sqlite3.connect(self.cache_path)
+        self._create_tables()
+        self.backend = get_backend(backend or self.default_backend())
+
+    def _create_tables(self):
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(files)")]
+        if columns and 'backend' not in columns:
+            # Cache written before text backends existed; it only holds derived data, so start over
+            self.connection.executescript("DROP TABLE files; DROP TABLE pages;")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                num_pages INTEGER NOT NULL,
+                backend TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                path TEXT NOT NULL,
+                page_num INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (path, page_num)
+            );
+        """)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def default_backend(self):
+        row = self.connection.execute("SELECT value FROM settings WHERE key = 'backend'").fetchone()
+        if row and row[0] in BACKENDS:
+            return row[0]
+        return DEFAULT_BACKEND
+
+    def set_default_backend(self, name):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('backend', ?)", (name,))
+
+    def _cached_signature(self, file_path):
+        """(size, mtime) of the cached text of <file_path>, if it was extracted with the current backend"""
+        row = self.connection.execute(
+            "SELECT size, mtime FROM files WHERE path = ? AND backend = ?", (file_path, self.backend.name)).fetchone()
+        return tuple(row) if row else None
+
+    def is_fresh(self, file_path):
+        file_path = os.path.abspath(file_path)
+        return self._cached_signature(file_path) == file_signature(file_path)
+
+    def get_page_texts(self, file_path):
+        """Returns the list of page texts of <file_path>, extracting them only if the file changed"""
+        file_path = os.path.abspath(file_path)
+        signature = file_signature(file_path)
+        if self._cached_signature(file_path) == signature:
+            rows = self.connection.execute(
+                "SELECT text FROM pages WHERE path = ? ORDER BY page_num", (file_path,)).fetchall()
+            return [text for (text,) in rows]
+
+        if self.debug:
+            print(f"Extracting text from: {file_path}", file=sys.stderr)
+        with profiler.span("extract_text", file=file_path, backend=self.backend.name):
+            texts = self.backend.extract_pages(file_path)
+            self.store(file_path, signature, texts)
+        return texts
+
+    def store(self, file_path, signature, texts):
+        size, mtime = signature
+        with self.connection:
+            self.connection.execute("DELETE FROM pages WHERE path = ?", (file_path,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, num_pages, backend) VALUES (?, ?, ?, ?, ?)",
+                (file_path, size, mtime, len(texts), self.backend.name))
+            self.connection.executemany(
+                "INSERT INTO pages (path, page_num, text) VALUES (?, ?, ?)",
+                [(file_path, page_num, text) for page_num, text in enumerate(texts, 1)])
+
+    def extract_parallel(self, file_paths, workers, pages_per_task=PAGES_PER_TASK):
+        """
+        Extracts the text of the new or changed files among <file_paths> across a pool of <workers>
+        workers (processes or threads, depending on the backend), splitting long statements into
+        ranges of <pages_per_task> pages.
+        Generator: yields every path of <file_paths>, in order, as soon as its text is cached.
+        Files that fail to extract are left uncached, so that the regular scan reports them.
+        """
+        stale = {file_path for file_path in file_paths if not self.is_fresh(file_path)}
+        if not stale:
+            yield from file_paths
+            return
+
+        if self.backend.executor_class is ProcessPoolExecutor:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupts)
+        else:
+            executor = self.backend.executor_class(max_workers=workers)
+        try:
+            pending = {}
+            for file_path in file_paths:
+                if file_path not in stale:
+                    continue
+                try:
+                    signature = file_signature(file_path)
+                    num_pages = self.backend.page_count(file_path)
+                except Exception:
+                    continue
+                futures = [executor.submit(extract_page_range, self.backend.name, file_path,
+                                           first, min(first + pages_per_task, num_pages))
+                           for first in range(0, num_pages, pages_per_task)]
+                pending[file_path] = (signature, futures)
+
+            for file_path in file_paths:
+                if file_path in pending:
+                    signature, futures = pending.pop(file_path)
+                    try:
+                        with profiler.span("extract_text_parallel", file=file_path, backend=self.backend.name):
+                            texts = [text for future in futures for text in future.result()]
+                            self.store(os.path.abspath(file_path), signature, texts)
+                        if self.debug:
+                            print(f"Extracted text from: {file_path}", file=sys.stderr)
+                    except Exception:
+                        pass
+                yield file_path
+        finally:
+            # Do not wait for the remaining files if the caller stopped early (e.g. on Ctrl-C)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def forget(self, file_path):
+        with self.connection:
+            self.connection.execute("DELETE FROM pages WHERE path = ?", (file_path,))
+            self.connection.execute("DELETE FROM files WHERE path = ?", (file_path,))
+
+    def prune(self):
+        """Removes the entries of files that no longer exist"""
+        removed = []
+        for (file_path,) in self.connection.execute("SELECT path FROM files").fetchall():
+            if not os.path.exists(file_path):
+                self.forget(file_path)
+                removed.append(file_path)
+        return removed
+
+    def refresh(self, workers=1):
+        """Re-extracts every new or changed pdf and drops the removed ones"""
+        stale = [file_path for file_path in iter_pdf_files(self.estatements_dir) if not self.is_fresh(file_path)]
+        if workers > 1:
+            for _ in self.extract_parallel(stale, workers):
+                pass
+        updated = 0
+        for file_path in stale:
+            try:
+                self.get_page_texts(file_path)
+                updated += 1
+            except Exception as e:
+                print(f"Error processing {file_path}: {str(e)}", file=sys.stderr)
+        removed = self.prune()
+        print(f"Updated {updated} file(s), dropped {len(removed)} deleted file(s) from {self.cache_path}")
+
+    def rebuild(self, workers=1):
+        """Drops the whole cache and extracts every pdf again"""
+        with self.connection:
+            self.connection.execute("DELETE FROM pages")
+            self.connection.execute("DELETE FROM files")
+        self.refresh(workers)
+
+    def verify(self):
+        """
+        Checks the cache against the eStatements directory without modifying it.
+        Returns a list of (file_path, problem) tuples; an empty list means the cache is up to date.
+        """
+        problems = []
+        on_disk = set()
+        for file_path in iter_pdf_files(self.estatements_dir):
+            file_path = os.path.abspath(file_path)
+            on_disk.add(file_path)
+            row = self.connection.execute(
+                "SELECT size, mtime, backend FROM files WHERE path = ?", (file_path,)).fetchone()
+            if row is None:
+                problems.append((file_path, "not cached"))
+            elif tuple(row[:2]) != file_signature(file_path):
+                problems.append((file_path, "changed since it was cached"))
+            elif row[2] != self.backend.name:
+                problems.append((file_path, f"extracted with {row[2]} instead of {self.backend.name}"))
+
+        rows = self.connection.execute(
+            "SELECT files.path, files.num_pages, COUNT(pages.page_num) FROM files "
+            "LEFT JOIN pages ON pages.path = files.path GROUP BY files.path").fetchall()
+        for file_path, num_pages, cached_pages in rows:
+            if file_path not in on_disk:
+                problems.append((file_path, "no longer exists"))
+            elif num_pages != cached_pages:
+                problems.append((file_path, f"has {cached_pages} of {num_pages} pages cached"))
+        return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the eStatements page text cache.")
+    parser.add_argument("estatements_directory", help="Directory containing eStatements PDFs")
+    parser.add_argument("command", choices=["refresh", "rebuild", "verify"],
+                        help="refresh: extract new/changed files, rebuild: start from scratch, verify: report stale entries")
+    parser.add_argument("--workers", type=int, default=1, help="Number of workers used to extract statement text")
+    parser.add_argument("--text-backend", choices=list(BACKENDS), help="Text extraction backend (default: the saved one, or pypdf2)")
+    parser.add_argument("--debug", action="store_true", help="Print every extracted file")
+    args = parser.parse_args()
+
+    cache = PageTextCache(args.estatements_directory, debug=args.debug, backend=args.text_backend)
+    if args.command == "refresh":
+        cache.refresh(args.workers)
+    elif args.command == "rebuild":
+        cache.rebuild(args.workers)
+    else:
+        problems = cache.verify()
+        for file_path, problem in problems:
+            print(f"{file_path}: {problem}")
+        if problems:
+            print(f"{len(problems)} problem(s) found. Run 'refresh' or 'rebuild' to fix the cache.")
+            cache.close()
+            sys.exit(1)
+        print("Page text cache is up to date.")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
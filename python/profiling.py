@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import resource
+import cProfile
+import threading
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+def cpu_time():
+    """CPU nanoseconds of the calling thread, plus those of the finished child processes (pdflatex, pdftoppm...)"""
+    times = os.times()
+    return time.thread_time_ns() + int((times.children_user + times.children_system) * 1e9)
+
+def reset_peak_rss():
+    """Resets the peak RSS of the process (Linux only). Returns False if it could not"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    """Peak resident set size of the process in bytes, since the last reset_peak_rss on Linux"""
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS, and never resets
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+def children_peak_rss():
+    """Largest peak RSS of the finished child processes (pdftoppm, pdflatex...) in bytes"""
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+class Profiler:
+    """
+    Records the wall and CPU time of the stages of the report pipeline and of their sub-operations
+    (statements scanned, pages rendered, pdflatex runs, ...). Does nothing until enabled, so the
+    spans can stay in the code. Writes a JSON summary, a Chrome trace (chrome://tracing, Perfetto)
+    and, if asked, a cProfile dump of every top-level stage. In memory mode, every top-level stage
+    also records its peak RSS, its tracemalloc peak and its top allocation sites.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.output_dir = None
+        self.cprofile = False
+        self.memory = False
+        self.events = []
+        self.profiled_stages = 0
+        self.origin = time.perf_counter_ns()
+        self._local = threading.local()
+
+    def enable(self, output_dir, cprofile=False, memory=False, traceback_frames=8):
+        self.enabled = True
+        self.output_dir = os.path.abspath(output_dir)
+        self.cprofile = cprofile
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(traceback_frames)
+        self.events = []
+        self.profiled_stages = 0
+        self.origin = time.perf_counter_ns()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    @contextmanager
+    def span(self, name, category='operation', **details):
+        """Times the enclosed block. Spans of category 'stage' are also cProfiled when asked to"""
+        if not self.enabled:
+            yield
+            return
+        depth = getattr(self._local, 'depth', 0)
+        profile = None
+        if self.cprofile and category == 'stage' and not getattr(self._local, 'profiling', False):
+            profile = cProfile.Profile()
+            self._local.profiling = True
+            profile.enable()
+        memory_before = None
+        if self.memory and category == 'stage' and not getattr(self._local, 'measuring_memory', False):
+            self._local.measuring_memory = True
+            memory_before = self._start_memory()
+        self._local.depth = depth + 1
+        start = time.perf_counter_ns()
+        cpu_start = cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter_ns() - start
+            cpu = cpu_time() - cpu_start
+            self._local.depth = depth
+            memory = None
+            if memory_before is not None:
+                memory = self._stop_memory(memory_before)
+                self._local.measuring_memory = False
+            if profile is not None:
+                profile.disable()
+                self._local.profiling = False
+                self.profiled_stages += 1
+                profile.dump_stats(os.path.join(self.output_dir, f"{self.profiled_stages:02d}-{name}.prof"))
+            self.events.append({
+                'name': name,
+                'category': category,
+                'start_us': (start - self.origin) / 1000,
+                'wall_us': wall / 1000,
+                'cpu_us': cpu / 1000,
+                'depth': depth,
+                'thread': threading.get_ident(),
+                'details': {key: str(value) for key, value in details.items()},
+                'memory': memory,
+            })
+
+    def _start_memory(self):
+        reset_peak_rss()
+        tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[0]
+
+    def _stop_memory(self, memory_before, top_sites=10):
+        """Peaks of the stage and the allocation sites that grew the most since <memory_before>"""
+        snapshot_before, traced_before = memory_before
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+        sites = snapshot.compare_to(snapshot_before, 'lineno')
+        sites = sorted(sites, key=lambda stat: stat.size_diff, reverse=True)[:top_sites]
+        return {
+            'peak_rss_bytes': peak_rss(),
+            'children_peak_rss_bytes': children_peak_rss(),
+            'python_peak_bytes': traced_peak - traced_before,
+            'python_retained_bytes': traced - traced_before,
+            'top_allocations': [{
+                'site': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                'size_diff_bytes': stat.size_diff,
+                'count_diff': stat.count_diff,
+            } for stat in sites if stat.size_diff > 0],
+        }
+
+    def summary(self):
+        """Total, mean and max wall/CPU seconds per span name, stages first in the order they ran"""
+        totals = defaultdict(lambda: {'category': None, 'count': 0, 'wall_seconds': 0.0,
+                                      'cpu_seconds': 0.0, 'max_wall_seconds': 0.0})
+        for event in sorted(self.events, key=lambda event: (event['category'] != 'stage', event['start_us'])):
+            total = totals[event['name']]
+            total['category'] = event['category']
+            total['count'] += 1
+            total['wall_seconds'] += event['wall_us'] / 1e6
+            total['cpu_seconds'] += event['cpu_us'] / 1e6
+            total['max_wall_seconds'] = max(total['max_wall_seconds'], event['wall_us'] / 1e6)
+            if event['memory']:
+                total['peak_rss_bytes'] = max(total.get('peak_rss_bytes', 0), event['memory']['peak_rss_bytes'])
+                total['python_peak_bytes'] = max(total.get('python_peak_bytes', 0), event['memory']['python_peak_bytes'])
+        for total in totals.values():
+            total['mean_wall_seconds'] = total['wall_seconds'] / total['count']
+        return dict(totals)
+
+    def memory_report(self):
+        """Memory measurements of every top-level stage, in the order they ran"""
+        return [dict(event['memory'], stage=event['name'], start_us=event['start_us'])
+                for event in sorted(self.events, key=lambda event: event['start_us']) if event['memory']]
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        return {'traceEvents': [{
+            'name': event['name'],
+            'cat': event['category'],
+            'ph': 'X',
+            'ts': event['start_us'],
+            'dur': event['wall_us'],
+            'pid': pid,
+            'tid': event['thread'],
+            'args': dict(event['details'], cpu_ms=event['cpu_us'] / 1000,
+                         **({'peak_rss_mb': event['memory']['peak_rss_bytes'] / 2**20} if event['memory'] else {})),
+        } for event in self.events]}
+
+    def write(self):
+        """Writes profile_summary.json and profile_trace.json to the output directory"""
+        if not self.enabled:
+            return
+        summary_path = os.path.join(self.output_dir, 'profile_summary.json')
+        trace_path = os.path.join(self.output_dir, 'profile_trace.json')
+        with open(summary_path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+        with open(trace_path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+        self.print_summary()
+        print(f"Profile saved to {summary_path} (trace: {trace_path})")
+        if self.memory:
+            memory_path = os.path.join(self.output_dir, 'memory_profile.json')
+            with open(memory_path, 'w') as file:
+                json.dump(self.memory_report(), file, indent=2)
+            self.print_memory_report()
+            print(f"Memory profile saved to {memory_path}")
+        if self.cprofile:
+            print(f"cProfile dumps of every stage saved to {self.output_dir}; read them with `python -m pstats <file>`")
+
+    def print_summary(self):
+        print(f"{'span':<36}{'count':>7}{'wall s':>10}{'cpu s':>10}")
+        for name, total in self.summary().items():
+            print(f"{name:<36}{total['count']:>7}{total['wall_seconds']:>10.3f}{total['cpu_seconds']:>10.3f}")
+
+    def print_memory_report(self, top_sites=3):
+        print(f"{'stage':<36}{'peak RSS MB':>12}{'python peak MB':>16}{'retained MB':>13}")
+        for stage in self.memory_report():
+            print(f"{stage['stage']:<36}{stage['peak_rss_bytes'] / 2**20:>12.1f}"
+                  f"{stage['python_peak_bytes'] / 2**20:>16.1f}{stage['python_retained_bytes'] / 2**20:>13.1f}")
+            for site in stage['top_allocations'][:top_sites]:
+                print(f"    {site['size_diff_bytes'] / 2**20:>8.2f} MB  {site['site']}")
+
+profiler = Profiler()
@@ -0,0 +1,283 @@
+import io
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path
+from PIL import Image
+from python.page_cache import file_signature
+from python.profiling import profiler
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                                 'cita_expense_reporter', 'rasters')
+DEFAULT_MAX_BYTES = 2 * 1024**3
+DEFAULT_DPI = 200  # What convert_from_path renders at when no dpi is given
+INDEX_FILENAME = 'index.sqlite'
+# Render modes and the PIL colorspaces they produce. Statements are black on white, so grayscale
+# and 1-bit pages hold the same information as RGB ones in a third of the memory
+RENDER_MODES = {'rgb': 'RGB', 'gray': 'L', 'mono': '1'}
+DEFAULT_RENDER_MODE = 'rgb'
+# Every render is a pdftoppm subprocess, so a few of them run at once from threads
+DEFAULT_RASTER_WORKERS = min(4, os.cpu_count() or 1)
+
+def rasterize_page(pdf_path, page_num, dpi=DEFAULT_DPI, colorspace='RGB'):
+    """Renders page <page_num> (1-based) of <pdf_path> with pdftoppm, directly in <colorspace> where it can"""
+    if colorspace == '1':
+        # pdf2image has no option for pdftoppm's -mono, so it is called directly; the PBM comes back on stdout
+        command = ['pdftoppm', '-mono', '-r', str(dpi), '-f', str(page_num), '-l', str(page_num), '-singlefile', pdf_path]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        image = Image.open(io.BytesIO(result.stdout))
+        image.load()
+    else:
+        image = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num,
+                                  grayscale=colorspace == 'L')[0]
+    if image.mode != colorspace:
+        image = image.convert(colorspace)
+    return image
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RasterCache:
+    """
+    Content-addressed on-disk cache of rendered pdf pages, keyed by (sha256 of the pdf, page, dpi, colorspace).
+    Shared by the censoring GUI and the JPEG conversion, so that a page that was rendered once opens
+    instantly afterwards, even from a freshly extracted copy of the same statement page.
+    Least recently used pages are evicted once the cache grows past <max_bytes>.
+    """
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Pages may be rendered from a background thread, so the connection is shared under a lock
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(os.path.join(self.cache_dir, INDEX_FILENAME), check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rasters (
+                pdf_hash TEXT NOT NULL,
+                page_num INTEGER NOT NULL,
+                dpi INTEGER NOT NULL,
+                colorspace TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (pdf_hash, page_num, dpi, colorspace)
+            );
+            CREATE INDEX IF NOT EXISTS rasters_last_used ON rasters (last_used);
+        """)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def pdf_hash(self, pdf_path):
+        """sha256 of <pdf_path>, only recomputed when its size or mtime changes"""
+        pdf_path = os.path.abspath(pdf_path)
+        signature = file_signature(pdf_path)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime, hash FROM sources WHERE path = ?", (pdf_path,)).fetchone()
+        if row and tuple(row[:2]) == signature:
+            return row[2]
+        pdf_hash = file_hash(pdf_path)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO sources (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                                    (pdf_path, signature[0], signature[1], pdf_hash))
+        return pdf_hash
+
+    def _raster_path(self, file_name):
+        return os.path.join(self.cache_dir, file_name[:2], file_name)
+
+    def get(self, pdf_hash, page_num, dpi, colorspace='RGB'):
+        """The cached rendering of page <page_num> (1-based) of the pdf with hash <pdf_hash>, or None"""
+        key = (pdf_hash, page_num, dpi, colorspace)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT file_name FROM rasters WHERE pdf_hash = ? AND page_num = ? AND dpi = ? AND colorspace = ?",
+                key).fetchone()
+        if row is None:
+            return None
+        try:
+            image = Image.open(self._raster_path(row[0]))
+            image.load()
+        except OSError:
+            # Removed or damaged behind our back
+            self._forget(key)
+            return None
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE rasters SET last_used = ? WHERE pdf_hash = ? AND page_num = ? AND dpi = ? AND colorspace = ?",
+                (time.time(),) + key)
+        return image
+
+    def put(self, pdf_hash, page_num, dpi, colorspace, image):
+        file_name = f"{pdf_hash}-{page_num}-{dpi}-{colorspace}.png"
+        path = self._raster_path(file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Statement pages are mostly white, so even the fastest PNG compression keeps them small
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        image.save(temp_path, 'PNG', compress_level=1)
+        os.replace(temp_path, path)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO rasters (pdf_hash, page_num, dpi, colorspace, file_name, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (pdf_hash, page_num, dpi, colorspace, file_name, os.path.getsize(path), time.time()))
+        self.evict()
+
+    def _forget(self, key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM rasters WHERE pdf_hash = ? AND page_num = ? AND dpi = ? AND colorspace = ?", key)
+
+    def total_bytes(self):
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM rasters").fetchone()[0]
+
+    def evict(self, max_bytes=None):
+        """Removes the least recently used pages until the cache fits in <max_bytes>. Returns how many"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = 0
+        with self.lock:
+            total = self.total_bytes()
+            if total <= max_bytes:
+                return 0
+            rows = self.connection.execute(
+                "SELECT pdf_hash, page_num, dpi, colorspace, file_name, size FROM rasters ORDER BY last_used").fetchall()
+            for pdf_hash, page_num, dpi, colorspace, file_name, size in rows:
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(self._raster_path(file_name))
+                except FileNotFoundError:
+                    pass
+                self._forget((pdf_hash, page_num, dpi, colorspace))
+                total -= size
+                removed += 1
+        return removed
+
+    def render_page(self, pdf_path, page_num, dpi=DEFAULT_DPI, colorspace='RGB'):
+        """Page <page_num> (1-based) of <pdf_path> as a PIL image, rendered only if it is not cached"""
+        pdf_hash = self.pdf_hash(pdf_path)
+        image = self.get(pdf_hash, page_num, dpi, colorspace)
+        if image is not None:
+            return image
+        with profiler.span("render_page", file=pdf_path, page=page_num, dpi=dpi, colorspace=colorspace):
+            image = rasterize_page(pdf_path, page_num, dpi, colorspace)
+        self.put(pdf_hash, page_num, dpi, colorspace, image)
+        return image
+
+_shared_cache = None
+
+def shared_raster_cache():
+    """The raster cache of this process, opened on first use"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = RasterCache()
+    return _shared_cache
+
+class RasterPool:
+    """
+    Renders pages through a raster cache on up to <workers> concurrent pdftoppm subprocesses.
+    Requests for a page that is already being rendered share its future. A <then> callback runs on the
+    worker with the image, and its result is returned instead, so that batch conversions only keep
+    about <workers> pages in memory.
+    """
+    def __init__(self, cache=None, workers=DEFAULT_RASTER_WORKERS):
+        self.cache = cache
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='raster')
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def submit(self, pdf_path, page_num, dpi=DEFAULT_DPI, colorspace='RGB', then=None):
+        """A future of page <page_num> (1-based) of <pdf_path>, or of then(image)"""
+        if then is not None:
+            return self.executor.submit(self._render_then, pdf_path, page_num, dpi, colorspace, then)
+        key = (os.path.abspath(pdf_path), page_num, dpi, colorspace)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None or future.cancelled():
+                future = self.executor.submit(self._render, pdf_path, page_num, dpi, colorspace)
+                self.in_flight[key] = future
+                future.add_done_callback(lambda done: self._done(key, done))
+        return future
+
+    def submit_batch(self, pages, dpi=DEFAULT_DPI, colorspace='RGB', then=None):
+        """Futures for <pages>, (pdf_path, page_num) pairs, in the same order"""
+        return [self.submit(pdf_path, page_num, dpi, colorspace, then) for pdf_path, page_num in pages]
+
+    def render_batch(self, pages, dpi=DEFAULT_DPI, colorspace='RGB', then=None):
+        """Renders <pages> concurrently and returns their images (or then(image) results) in order"""
+        return [future.result() for future in self.submit_batch(pages, dpi, colorspace, then)]
+
+    def _cache(self):
+        return self.cache or shared_raster_cache()
+
+    def _render(self, pdf_path, page_num, dpi, colorspace):
+        return self._cache().render_page(pdf_path, page_num, dpi, colorspace)
+
+    def _render_then(self, pdf_path, page_num, dpi, colorspace, then):
+        return then(self._render(pdf_path, page_num, dpi, colorspace))
+
+    def _done(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+_shared_pool = None
+
+def shared_raster_pool():
+    """The rasterization pool of this process, started on first use"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = RasterPool()
+    return _shared_pool
+
+def set_raster_workers(workers):
+    """Sets the concurrency of the shared rasterization pool"""
+    global _shared_pool
+    if _shared_pool is not None:
+        if _shared_pool.workers == workers:
+            return
+        _shared_pool.shutdown(wait=False)
+    _shared_pool = RasterPool(workers=workers)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the cache of rendered statement pages.")
+    parser.add_argument("command", choices=["stats", "evict", "clear"], help="Action to perform on the cache")
+    parser.add_argument("--cache-dir", help=f"Cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--max-mb", type=float, help="Size to evict down to, in megabytes")
+    args = parser.parse_args()
+
+    cache = RasterCache(args.cache_dir)
+    if args.command == "stats":
+        with cache.lock:
+            pages = cache.connection.execute("SELECT COUNT(*) FROM rasters").fetchone()[0]
+        print(f"{pages} page(s), {cache.total_bytes() / 2**20:.1f} MB in {cache.cache_dir}")
+    elif args.command == "evict":
+        max_bytes = int(args.max_mb * 2**20) if args.max_mb is not None else None
+        print(f"Evicted {cache.evict(max_bytes)} page(s) from {cache.cache_dir}")
+    elif args.command == "clear":
+        print(f"Evicted {cache.evict(0)} page(s) from {cache.cache_dir}")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import re
+from array import array
+from collections import namedtuple
+
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+DATE_REGEX = re.compile(r'\b(' + '|'.join(MONTHS) + r')\s+(\d{2})\b')
+AMOUNT_REGEX = re.compile(r'\d*\$(\d[\d,]*\.\d{2})')
+
+class StatementRecord(namedtuple('StatementRecord', [
+        'record_id', 'file', 'page', 'first_line', 'last_line', 'month', 'day',
+        'posting_month', 'posting_day', 'amount_cents', 'text', 'head_length'])):
+    """
+    A transaction parsed out of a statement page. <text> holds the lines first_line..last_line
+    joined by spaces, and <head_length> is the length of the first of them.
+    A posting_month of 0 means the statement line has no posting date.
+    """
+    __slots__ = ()
+
+    @property
+    def date(self):
+        """Transaction date as MM-DD, the format used in selected_transactions.csv"""
+        return f"{self.month:02d}-{self.day:02d}"
+
+    @property
+    def posting_date(self):
+        if not self.posting_month:
+            return None
+        return f"{self.posting_month:02d}-{self.posting_day:02d}"
+
+    @property
+    def amount(self):
+        return f"{self.amount_cents // 100}.{self.amount_cents % 100:02d}"
+
+    @property
+    def head(self):
+        """The statement line that the transaction starts on"""
+        return self.text[:self.head_length]
+
+    @property
+    def description(self):
+        description = DATE_REGEX.sub('', self.text)
+        description = AMOUNT_REGEX.sub('', description)
+        return ' '.join(description.split())
+
+    def summary(self):
+        return f"{MONTHS[self.month - 1]} {self.day:02d} ${self.amount} - {self.text}"
+
+def parse_page(lines):
+    """
+    Parses every line of a statement page that starts a transaction, i.e. the line holds a date and
+    the lines from it up to the first one with a $ contain an amount. The dates are those of the
+    line itself, and a transaction never runs into the next dated line, so that headers, continuation
+    lines and dated lines without an amount do not pick up the next transaction's date or amount.
+    Runs of whitespace are collapsed, so that the column padding of `pdftotext -layout` does not keep
+    multi-word search terms from matching.
+    Yields (first_line, last_line, month, day, posting_month, posting_day, amount_cents, text, head_length).
+    """
+    stripped_lines = [' '.join(line.split()) for line in lines]
+    line_dates = [DATE_REGEX.findall(line) for line in stripped_lines]
+
+    # For every line, the index of the first line at or after it that contains a $,
+    # and the index of the first dated line after it
+    span_ends = [0] * len(lines)
+    next_dated = [0] * len(lines)
+    end_index = dated_index = len(lines)
+    for i in range(len(lines) - 1, -1, -1):
+        if '$' in lines[i]:
+            end_index = i
+        span_ends[i] = end_index
+        next_dated[i] = dated_index
+        if line_dates[i]:
+            dated_index = i
+
+    for first_line, last_line in enumerate(span_ends):
+        dates = line_dates[first_line]
+        if not dates or last_line >= next_dated[first_line]:
+            continue
+        text = ' '.join(stripped_lines[first_line:last_line + 1])
+        amount_match = AMOUNT_REGEX.search(text)
+        if not amount_match:
+            continue
+
+        month, day = MONTHS.index(dates[0][0]) + 1, int(dates[0][1])
+        posting_month, posting_day = (MONTHS.index(dates[1][0]) + 1, int(dates[1][1])) if len(dates) > 1 else (0, 0)
+        amount_cents = int(amount_match.group(1).replace(',', '').replace('.', ''))
+        yield (first_line, last_line, month, day, posting_month, posting_day,
+               amount_cents, text, len(stripped_lines[first_line]))
+
+class TransactionStore:
+    """
+    Column store of parsed transactions. Numeric fields live in typed arrays and the statement
+    paths are interned, so that a multi-year archive stays compact in memory.
+    Records of removed files are only marked dead, so record ids stay valid for the session.
+    """
+    def __init__(self):
+        self.file_paths = []
+        self.file_ids = {}
+        self.record_files = array('I')
+        self.pages = array('I')
+        self.first_lines = array('I')
+        self.last_lines = array('I')
+        self.months = array('B')
+        self.days = array('B')
+        self.posting_months = array('B')
+        self.posting_days = array('B')
+        self.amounts = array('q')
+        self.head_lengths = array('I')
+        self.alive = array('B')
+        self.texts = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, record_id):
+        return StatementRecord(
+            record_id, self.file_paths[self.record_files[record_id]], self.pages[record_id],
+            self.first_lines[record_id], self.last_lines[record_id],
+            self.months[record_id], self.days[record_id],
+            self.posting_months[record_id], self.posting_days[record_id],
+            self.amounts[record_id], self.texts[record_id], self.head_lengths[record_id])
+
+    def add_page(self, file_path, page_num, lines):
+        """Parses a statement page and returns the ids of the records added for it"""
+        if file_path not in self.file_ids:
+            self.file_ids[file_path] = len(self.file_paths)
+            self.file_paths.append(file_path)
+        file_id = self.file_ids[file_path]
+
+        # Parse the whole page before touching the columns, so that they stay aligned if interrupted
+        rows = list(parse_page(lines))
+        record_ids = []
+        for first_line, last_line, month, day, posting_month, posting_day, amount_cents, text, head_length in rows:
+            record_ids.append(len(self.texts))
+            self.record_files.append(file_id)
+            self.pages.append(page_num)
+            self.first_lines.append(first_line)
+            self.last_lines.append(last_line)
+            self.months.append(month)
+            self.days.append(day)
+            self.posting_months.append(posting_month)
+            self.posting_days.append(posting_day)
+            self.amounts.append(amount_cents)
+            self.head_lengths.append(head_length)
+            self.alive.append(1)
+            self.texts.append(text)
+        return record_ids
+
+    def remove_file(self, file_path):
+        """Marks the records of <file_path> dead and returns their ids"""
+        file_id = self.file_ids.get(file_path)
+        if file_id is None:
+            return []
+        removed = [i for i, record_file in enumerate(self.record_files) if record_file == file_id and self.alive[i]]
+        for record_id in removed:
+            self.alive[record_id] = 0
+            self.texts[record_id] = ''
+        return removed
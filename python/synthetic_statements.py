@@ -0,0 +1,105 @@
+import os
+import random
+import argparse
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from python.statement_parser import MONTHS
+
+ACCOUNT_TYPES = ['Visa', 'Chequing']
+VENDORS = [
+    'PIZZAIOLO #12 TORONTO ON', 'UBER CANADA/UBERTRIP TORONTO ON', 'AMAZON.CA AMAZON.CA ON',
+    'LOBLAWS 1012 TORONTO ON', 'TIM HORTONS #2211 TORONTO ON', 'STAPLES STORE #62 TORONTO ON',
+    'AIR CANADA 0142103 WINNIPEG MB', 'PRESTO FARE/RELOAD TORONTO ON', 'SHOPPERS DRUG MART #08 TORONTO ON',
+    'UOFT BOOKSTORE TORONTO ON', 'METRO 523 TORONTO ON', 'DOMINOS PIZZA 10021 TORONTO ON',
+]
+LINE_HEIGHT = 12
+TOP_MARGIN = 60
+LEFT_MARGIN = 40
+
+def transaction_line(account_type, month, day, vendor, amount_cents, rng):
+    """A statement line in the layout of the RBC statements, as PyPDF2 extracts it"""
+    amount = f"${amount_cents // 100:,}.{amount_cents % 100:02d}"
+    date = f"{MONTHS[month - 1]} {day:02d}"
+    if account_type == 'Visa':
+        # Credit card lines carry a transaction date and a posting date
+        posting_day = min(day + rng.randint(0, 2), 28)
+        return f"{date} {MONTHS[month - 1]} {posting_day:02d} {vendor} {amount}"
+    return f"{date} Contactless Interac purchase - {rng.randint(1000, 9999)} {vendor} {amount}"
+
+def write_statement(path, account_type, year, month, pages, transactions_per_page, rng, single_text_block=False):
+    """
+    Writes a synthetic statement of <pages> pages and returns the number of transactions on it.
+    Every line is drawn in its own text block, or with <single_text_block> all the lines of a page are
+    drawn in one, moving down with Td like many bank statements do.
+    """
+    pdf = canvas.Canvas(path, pagesize=letter)
+    _, page_height = letter
+    transactions = 0
+    for page_num in range(1, pages + 1):
+        lines = [f"RBC Royal Bank {account_type} statement", f"Statement period {MONTHS[month - 1]} {year}",
+                 f"Page {page_num} of {pages}", None]
+        days = sorted(rng.randint(1, 28) for _ in range(transactions_per_page))
+        for day in days:
+            if page_height - TOP_MARGIN - len(lines) * LINE_HEIGHT < TOP_MARGIN:
+                break
+            lines.append(transaction_line(account_type, month, day, rng.choice(VENDORS), rng.randint(100, 50000), rng))
+            transactions += 1
+
+        if single_text_block:
+            text = pdf.beginText(LEFT_MARGIN, page_height - TOP_MARGIN)
+            text.setFont('Helvetica', 9)
+            for line in lines:
+                if line is not None:
+                    text.textOut(line)
+                text.moveCursor(0, LINE_HEIGHT)
+            pdf.drawText(text)
+        else:
+            pdf.setFont('Helvetica', 9)
+            for i, line in enumerate(lines):
+                if line is not None:
+                    pdf.drawString(LEFT_MARGIN, page_height - TOP_MARGIN - i * LINE_HEIGHT, line)
+        pdf.showPage()
+    pdf.save()
+    return transactions
+
+def generate_archive(directory, years=1, accounts=2, transactions_per_page=30, pages_per_statement=2,
+                     first_year=2024, seed=0, single_text_block=False):
+    """
+    Generates a synthetic eStatements archive laid out like the real one: <directory>/<year>/<account>/MM-DD.pdf,
+    one statement per account and month. Accounts alternate between credit card and chequing layouts.
+    Returns (file_paths, number_of_transactions).
+    """
+    rng = random.Random(seed)
+    file_paths = []
+    transactions = 0
+    for year in range(first_year, first_year + years):
+        for account in range(accounts):
+            account_type = ACCOUNT_TYPES[account % len(ACCOUNT_TYPES)]
+            account_dir = os.path.join(directory, str(year), f"{account_type}-{account + 1}")
+            os.makedirs(account_dir, exist_ok=True)
+            for month in range(1, 13):
+                path = os.path.join(account_dir, f"{month:02d}-15.pdf")
+                transactions += write_statement(path, account_type, year, month, pages_per_statement,
+                                                transactions_per_page, rng, single_text_block)
+                file_paths.append(path)
+    return file_paths, transactions
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic archive of RBC-style eStatements.")
+    parser.add_argument("directory", help="Directory to write the statements to")
+    parser.add_argument("--years", type=int, default=1, help="Number of years of statements")
+    parser.add_argument("--accounts", type=int, default=2, help="Number of accounts (credit card and chequing alternate)")
+    parser.add_argument("--transactions-per-page", type=int, default=30, help="Transactions on every statement page")
+    parser.add_argument("--pages", type=int, default=2, help="Pages per statement")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--single-text-block", action="store_true",
+                        help="Draw every page in a single text block, with Td moves between the lines")
+    args = parser.parse_args()
+
+    file_paths, transactions = generate_archive(args.directory, args.years, args.accounts,
+                                                args.transactions_per_page, args.pages, seed=args.seed,
+                                                single_text_block=args.single_text_block)
+    print(f"Wrote {len(file_paths)} statements with {transactions} transactions to {args.directory}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PyPDF2 import PdfReader
+
+DEFAULT_BACKEND = 'pypdf2'
+VENDOR_SAMPLE = 20
+
+class PyPDF2Backend:
+    """Text extraction in-process with PyPDF2. CPU-bound, so it is parallelized with processes"""
+    name = 'pypdf2'
+    executor_class = ProcessPoolExecutor
+
+    @staticmethod
+    def available():
+        return True
+
+    def page_count(self, file_path):
+        return len(PdfReader(file_path).pages)
+
+    def extract_pages(self, file_path, first_page=0, last_page=None):
+        """Texts of pages [first_page, last_page) of <file_path>, all pages by default"""
+        pdf = PdfReader(file_path)
+        last_page = len(pdf.pages) if last_page is None else last_page
+        return [pdf.pages[i].extract_text() for i in range(first_page, last_page)]
+
+class PdftotextBackend:
+    """
+    Text extraction with poppler's `pdftotext -layout`. The work happens in the subprocesses,
+    so a thread pool is enough to run several of them at once
+    """
+    name = 'pdftotext'
+    executor_class = ThreadPoolExecutor
+
+    @staticmethod
+    def available():
+        return shutil.which('pdftotext') is not None and shutil.which('pdfinfo') is not None
+
+    def page_count(self, file_path):
+        result = subprocess.run(['pdfinfo', file_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+        for line in result.stdout.splitlines():
+            if line.startswith('Pages:'):
+                return int(line.split()[1])
+        raise ValueError(f"pdfinfo did not report a page count for {file_path}")
+
+    def extract_pages(self, file_path, first_page=0, last_page=None):
+        if last_page is None:
+            last_page = self.page_count(file_path)
+        if first_page >= last_page:
+            return []
+        command = ['pdftotext', '-layout', '-f', str(first_page + 1), '-l', str(last_page), file_path, '-']
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+        # pdftotext ends every page with a form feed
+        return result.stdout.split('\f')[:last_page - first_page]
+
+BACKENDS = {backend.name: backend for backend in (PyPDF2Backend, PdftotextBackend)}
+
+def get_backend(name=None):
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown text backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]
+    if not backend.available():
+        raise RuntimeError(f"Text backend '{name}' is not available on this system")
+    return backend()
+
+def available_backends():
+    return [name for name, backend in BACKENDS.items() if backend.available()]
+
+def prefilter_matches(file_path, search_terms):
+    """
+    pdfgrep-based prefilter: tells whether any of <search_terms> occurs in <file_path> (case-insensitive),
+    so that statements without a match can be skipped before the full parse.
+    Errs on the side of a match if pdfgrep is missing or fails.
+    """
+    if shutil.which('pdfgrep') is None or not search_terms:
+        return True
+    command = ['pdfgrep', '-q', '-i', '-F']
+    for term in search_terms:
+        command += ['-e', term]
+    command.append(file_path)
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode != 1
+
+def sample_vendors(texts, count=VENDOR_SAMPLE):
+    """Up to <count> distinct transaction descriptions spread over <texts>, to check that searches still match"""
+    from python.statement_parser import DATE_REGEX, AMOUNT_REGEX
+
+    descriptions = []
+    for text in texts:
+        description = ' '.join(AMOUNT_REGEX.sub('', DATE_REGEX.sub('', text)).split()).upper()
+        if description and description not in descriptions:
+            descriptions.append(description)
+    step = max(1, len(descriptions) // count)
+    return descriptions[::step][:count]
+
+def benchmark_backends(file_paths, vendors=None):
+    """
+    Extracts <file_paths> with every available backend and parses the result.
+    Every backend is also searched for <vendors>, by default descriptions sampled from the transactions of the
+    default backend, since column padding or reordering can keep vendor names from matching.
+    Returns a list of dicts with the throughput, the number of transactions parsed and the number of vendors
+    found per backend.
+    """
+    from python.statement_parser import parse_page
+    from python.multi_pattern import AhoCorasick
+
+    results = []
+    record_texts = {}
+    for name in available_backends():
+        backend = get_backend(name)
+        texts = record_texts[name] = []
+        pages = 0
+        transactions = 0
+        errors = 0
+        start = time.perf_counter()
+        for file_path in file_paths:
+            try:
+                page_texts = backend.extract_pages(file_path)
+            except Exception:
+                errors += 1
+                continue
+            pages += len(page_texts)
+            for page_text in page_texts:
+                for row in parse_page(page_text.split('\n')):
+                    transactions += 1
+                    texts.append(row[7])
+        elapsed = time.perf_counter() - start
+        results.append({
+            'backend': name,
+            'files': len(file_paths),
+            'pages': pages,
+            'errors': errors,
+            'seconds': elapsed,
+            'pages_per_second': pages / elapsed if elapsed else 0.0,
+            'transactions': transactions,
+        })
+
+    if vendors is None:
+        reference = DEFAULT_BACKEND if DEFAULT_BACKEND in record_texts else next(iter(record_texts), None)
+        vendors = sample_vendors(record_texts.get(reference, []))
+    matcher = AhoCorasick([' '.join(vendor.split()).upper() for vendor in vendors]) if vendors else None
+    for result in results:
+        found = set()
+        if matcher is not None:
+            for text in record_texts[result['backend']]:
+                found |= matcher.match_indices(text.upper())
+        result['vendors'] = len(vendors)
+        result['vendors_found'] = len(found)
+    return results
+
+def pick_backend(results, min_transaction_ratio=0.9):
+    """
+    The fastest backend that still parses at least <min_transaction_ratio> of the transactions
+    found by the best backend, and finds every vendor that the best backend finds
+    """
+    most_transactions = max((result['transactions'] for result in results), default=0)
+    most_vendors = max((result.get('vendors_found', 0) for result in results), default=0)
+    usable = [result for result in results
+              if result['transactions'] > 0 and result['transactions'] >= min_transaction_ratio * most_transactions
+              and result.get('vendors_found', 0) >= most_vendors]
+    if not usable:
+        return None
+    return max(usable, key=lambda result: result['pages_per_second'])['backend']
+
+def main():
+    from python.page_cache import PageTextCache, iter_pdf_files
+    from python.multi_pattern import read_search_terms
+
+    parser = argparse.ArgumentParser(description="Benchmark the text extraction backends on the local eStatements.")
+    parser.add_argument("estatements_directory", help="Directory containing eStatements PDFs")
+    parser.add_argument("--sample", type=int, default=0, help="Only benchmark the first N statements (default: all)")
+    parser.add_argument("--no-save", action="store_true", help="Do not make the picked backend the default for the page cache")
+    parser.add_argument("--vendors-file", help="Vendors that every backend must find, one per line "
+                                               "(default: descriptions sampled from the statements)")
+    args = parser.parse_args()
+
+    file_paths = list(iter_pdf_files(args.estatements_directory))
+    if args.sample:
+        file_paths = file_paths[:args.sample]
+    if not file_paths:
+        print(f"No pdf files found in {args.estatements_directory}")
+        sys.exit(1)
+
+    vendors = read_search_terms(args.vendors_file) if args.vendors_file else None
+    results = benchmark_backends(file_paths, vendors)
+    print(f"{'backend':<12}{'pages':>8}{'seconds':>10}{'pages/s':>10}{'transactions':>14}{'vendors':>10}{'errors':>8}")
+    for result in results:
+        print(f"{result['backend']:<12}{result['pages']:>8}{result['seconds']:>10.2f}"
+              f"{result['pages_per_second']:>10.1f}{result['transactions']:>14}"
+              f"{result['vendors_found']:>5}/{result['vendors']:<4}{result['errors']:>8}")
+
+    best = pick_backend(results)
+    if best is None:
+        print("No backend both parses the transactions and finds the vendors.")
+        sys.exit(1)
+    print(f"Fastest backend with parseable transactions: {best}")
+    if not args.no_save:
+        cache = PageTextCache(args.estatements_directory)
+        cache.set_default_backend(best)
+        cache.close()
+        print(f"Saved {best} as the default text backend for {args.estatements_directory}")
+
+if __name__ == "__main__":
+    main()
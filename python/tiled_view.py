@@ -0,0 +1,308 @@
+import math
+import queue
+import threading
+from PIL import Image, ImageTk
+
+TILE_SIZE = 256
+MARGIN_TILES = 1
+TILE_TAG = 'tile'
+OVERLAY_TAG = 'overlay'
+PYRAMID_FACTORS = (2, 4, 8)
+REFINE_DELAY_MS = 200
+POLL_MS = 15
+
+# Tile qualities: a quick tile stays on screen until its high-quality replacement is ready
+QUICK, HIGH = 1, 2
+
+def displayable(image):
+    """1-bit images cannot be reduced or resampled smoothly, so they are shown from an 8-bit copy"""
+    return image.convert('L') if image.mode == '1' else image
+
+def build_pyramid(image):
+    """Box-filtered 1/2, 1/4 and 1/8 versions of <image>, keyed by their reduction factor"""
+    return {factor: image.reduce(factor) for factor in PYRAMID_FACTORS}
+
+class TiledImageView:
+    """
+    Shows a PIL image on a tk canvas at any zoom by rendering only the tiles that cover the visible
+    part of the canvas, plus a margin. Tiles are kept while scrolling and only re-rendered when the
+    zoom changes, so the cost of an event depends on the
+    window size rather than on the page size times the zoom.
+    While the user is zooming, tiles are sampled with a bilinear filter from the closest level of a
+    1/2 ... 1/8 pyramid of the image, built in a background thread. The high-quality LANCZOS tiles
+    replace them once the zoom has not changed for REFINE_DELAY_MS.
+    Tiles are resampled on a render thread. Only the latest requested view is rendered: a new request
+    replaces the pending one, and the thread drops the rest of its current one. Finished tiles are
+    handed back to the Tk main loop, which polls for them while the thread is busy.
+    Overlays (e.g. redaction rectangles) are plain canvas items kept in image coordinates, drawn
+    above the tiles and moved along when the zoom changes; the image itself is never touched.
+    """
+    def __init__(self, canvas, image, tile_size=TILE_SIZE, margin_tiles=MARGIN_TILES):
+        self.canvas = canvas
+        self.image = displayable(image)
+        self.tile_size = tile_size
+        self.margin_tiles = margin_tiles
+        self.zoom = 1.0
+        self.origin_x = 0.0
+        self.origin_y = 0.0
+        # (column, row) -> (PhotoImage, canvas item, quality)
+        self.tiles = {}
+        # Items of the previous zoom, shown until the new tiles cover the view
+        self.stale_items = []
+        # canvas item -> (x1, y1, x2, y2) in image coordinates
+        self.overlays = {}
+        # Bumped whenever rendered tiles may no longer match the zoom
+        self.content_version = 0
+        self.refresh_pending = False
+        self.interactive = False
+        self.refine_job = None
+        self.drain_job = None
+        self.closed = False
+
+        self.pyramid = None
+
+        self.requests = threading.Condition()
+        self.pending_request = None
+        self.rendering = False
+        self.results = queue.SimpleQueue()
+        threading.Thread(target=self._render_loop, daemon=True).start()
+
+        self.configure_binding = self.canvas.bind('<Configure>', lambda event: self.schedule_refresh(), add='+')
+        threading.Thread(target=self._build_pyramid, daemon=True).start()
+
+    def close(self):
+        """Stops the render thread and removes the tiles from the canvas"""
+        with self.requests:
+            self.closed = True
+            self.pending_request = None
+            self.requests.notify()
+        for job in (self.refine_job, self.drain_job):
+            if job is not None:
+                self.canvas.after_cancel(job)
+        self.refine_job = self.drain_job = None
+        self.canvas.unbind('<Configure>', self.configure_binding)
+        self.clear()
+        self._delete_stale()
+        for item in self.overlays:
+            self.canvas.delete(item)
+        self.overlays = {}
+
+    def _build_pyramid(self):
+        self.pyramid = build_pyramid(self.image)
+
+    def attach_scrollbars(self, v_scrollbar, h_scrollbar):
+        """Lets the scrollbars follow the canvas, and brings in the tiles that scroll into view"""
+        def on_yscroll(*args):
+            v_scrollbar.set(*args)
+            self.schedule_refresh()
+
+        def on_xscroll(*args):
+            h_scrollbar.set(*args)
+            self.schedule_refresh()
+
+        self.canvas.configure(yscrollcommand=on_yscroll, xscrollcommand=on_xscroll)
+
+    @property
+    def display_size(self):
+        return max(1, round(self.image.width * self.zoom)), max(1, round(self.image.height * self.zoom))
+
+    def set_zoom(self, zoom, focus_x=None, focus_y=None):
+        """
+        Zooms around the canvas point (focus_x, focus_y), or resets the view to the top left corner.
+        Draws quick tiles first, and the high-quality ones once the zoom stops changing.
+        """
+        if focus_x is None or focus_y is None:
+            self.origin_x, self.origin_y = 0.0, 0.0
+        else:
+            self.origin_x = focus_x - (focus_x - self.origin_x) * zoom / self.zoom
+            self.origin_y = focus_y - (focus_y - self.origin_y) * zoom / self.zoom
+        self.zoom = zoom
+        self.interactive = True
+        self.content_version += 1
+        self._make_stale()
+        for item, box in self.overlays.items():
+            self.canvas.coords(item, *self._overlay_coords(box))
+        self.schedule_refresh()
+        if self.refine_job is not None:
+            self.canvas.after_cancel(self.refine_job)
+        self.refine_job = self.canvas.after(REFINE_DELAY_MS, self.refine)
+
+    def refine(self):
+        """Asks for high-quality replacements of the quick tiles"""
+        self.refine_job = None
+        self.interactive = False
+        self.refresh()
+
+    def clear(self):
+        for tile in self.tiles.values():
+            self.canvas.delete(tile[1])
+        self.tiles = {}
+
+    def _make_stale(self):
+        """Keeps the current tiles on screen, as placeholders, until the new ones are drawn"""
+        self.stale_items.extend(tile[1] for tile in self.tiles.values())
+        self.tiles = {}
+
+    def _delete_stale(self):
+        for item in self.stale_items:
+            self.canvas.delete(item)
+        self.stale_items = []
+
+    def schedule_refresh(self):
+        # Wheel and scroll events come in bursts; handle the view once the event queue is drained
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.canvas.after_idle(self.refresh)
+
+    def _tile_range(self, start, end, axis):
+        """Indices of the tiles covering display coordinates [start, end) along <axis>, clipped to the image"""
+        count = math.ceil(self.display_size[axis] / self.tile_size)
+        first = max(0, math.floor(start / self.tile_size))
+        last = min(count - 1, math.floor(max(start, end - 1) / self.tile_size))
+        return first, last
+
+    def _view(self):
+        left = self.canvas.canvasx(0) - self.origin_x
+        top = self.canvas.canvasy(0) - self.origin_y
+        return left, top, left + max(self.canvas.winfo_width(), 1), top + max(self.canvas.winfo_height(), 1)
+
+    def _visible_tiles(self, margin_tiles):
+        left, top, right, bottom = self._view()
+        margin = margin_tiles * self.tile_size
+        first_column, last_column = self._tile_range(left - margin, right + margin, 0)
+        first_row, last_row = self._tile_range(top - margin, bottom + margin, 1)
+        return {(column, row) for column in range(first_column, last_column + 1)
+                for row in range(first_row, last_row + 1)}
+
+    def refresh(self):
+        """Requests the missing or outdated tiles around the view and drops the ones that scrolled far away"""
+        self.refresh_pending = False
+        if self.closed:
+            return
+        width, height = self.display_size
+        self.canvas.configure(scrollregion=(self.origin_x, self.origin_y,
+                                            self.origin_x + width, self.origin_y + height))
+        keep = self._visible_tiles(2 * self.margin_tiles)
+        for key in [key for key in self.tiles if key not in keep]:
+            self.canvas.delete(self.tiles.pop(key)[1])
+
+        quality = QUICK if self.interactive else HIGH
+        wanted = [key for key in self._visible_tiles(self.margin_tiles)
+                  if key not in self.tiles or self.tiles[key][2] < quality]
+        if not wanted:
+            self._delete_stale()
+            return
+        # Tiles closest to the middle of the window first
+        left, top, right, bottom = self._view()
+        middle_x, middle_y = (left + right) / 2, (top + bottom) / 2
+        wanted.sort(key=lambda key: abs((key[0] + 0.5) * self.tile_size - middle_x)
+                    + abs((key[1] + 0.5) * self.tile_size - middle_y))
+        with self.requests:
+            self.pending_request = (self.content_version, self.zoom, quality, wanted, self.image, self.pyramid)
+            self.requests.notify()
+        self._schedule_drain()
+
+    def _render_loop(self):
+        """Render thread: resamples the tiles of the latest request, giving up on it as soon as a newer one comes"""
+        while True:
+            with self.requests:
+                while self.pending_request is None and not self.closed:
+                    self.rendering = False
+                    self.requests.wait()
+                if self.closed:
+                    return
+                request, self.pending_request = self.pending_request, None
+                self.rendering = True
+            version, zoom, quality, keys, image, pyramid = request
+            for key in keys:
+                if self.pending_request is not None or self.closed:
+                    break
+                try:
+                    tile = self._render_tile(key, zoom, quality, image, pyramid)
+                except Exception:
+                    # The view was closed under us; the request is outdated anyway
+                    break
+                self.results.put((version, key, quality, tile))
+
+    def _schedule_drain(self):
+        if self.drain_job is None and not self.closed:
+            self.drain_job = self.canvas.after(POLL_MS, self._drain)
+
+    def _drain(self):
+        """Main loop side: puts the tiles finished by the render thread on the canvas"""
+        self.drain_job = None
+        keep = self._visible_tiles(2 * self.margin_tiles)
+        placed = False
+        while True:
+            try:
+                version, key, quality, tile = self.results.get_nowait()
+            except queue.Empty:
+                break
+            current = self.tiles.get(key)
+            if version != self.content_version or key not in keep or (current and current[2] >= quality):
+                continue
+            photo = ImageTk.PhotoImage(tile)
+            x, y = key[0] * self.tile_size, key[1] * self.tile_size
+            item = self.canvas.create_image(self.origin_x + x, self.origin_y + y, anchor='nw',
+                                            image=photo, tags=(TILE_TAG,))
+            if current is not None:
+                self.canvas.delete(current[1])
+            self.tiles[key] = (photo, item, quality)
+            placed = True
+        if placed:
+            if self.stale_items and self._visible_tiles(0) <= self.tiles.keys():
+                self._delete_stale()
+            # Keep the tiles under the rectangles being drawn
+            self.canvas.tag_lower(TILE_TAG)
+        with self.requests:
+            busy = self.rendering or self.pending_request is not None
+        if busy or not self.results.empty():
+            self._schedule_drain()
+
+    def _source_level(self, zoom, pyramid):
+        """(image, scale) to sample quick tiles from: the smallest pyramid level still larger than the zoom"""
+        if pyramid is not None:
+            for factor in sorted(pyramid, reverse=True):
+                if 1 / factor >= zoom:
+                    return pyramid[factor], 1 / factor
+        return None, 1.0
+
+    def _render_tile(self, key, zoom, quality, image, pyramid):
+        """Resamples one tile. Runs on the render thread, so it only reads its arguments"""
+        column, row = key
+        width, height = max(1, round(image.width * zoom)), max(1, round(image.height * zoom))
+        x1, y1 = column * self.tile_size, row * self.tile_size
+        x2, y2 = min(x1 + self.tile_size, width), min(y1 + self.tile_size, height)
+        source, scale = image, 1.0
+        if quality == QUICK:
+            level, level_scale = self._source_level(zoom, pyramid)
+            if level is not None:
+                source, scale = level, level_scale
+        box = (x1 / zoom * scale, y1 / zoom * scale,
+               min(x2 / zoom * scale, source.width), min(y2 / zoom * scale, source.height))
+        if quality == HIGH:
+            # reducing_gap first shrinks by whole factors when zoomed out, so tiles stay cheap at any zoom
+            return source.resize((x2 - x1, y2 - y1), Image.LANCZOS, box=box,
+                                 reducing_gap=2.0 if zoom < 1 else None)
+        # Pillow filters widen with the reduction, so only a level close to the zoom makes bilinear cheap
+        resample = Image.BILINEAR if source is not image or zoom >= 0.5 else Image.NEAREST
+        return source.resize((x2 - x1, y2 - y1), resample, box=box)
+
+    def _overlay_coords(self, box):
+        # Image boxes are inclusive, like those of ImageDraw.rectangle
+        x1, y1, x2, y2 = box
+        return (self.origin_x + x1 * self.zoom, self.origin_y + y1 * self.zoom,
+                self.origin_x + (x2 + 1) * self.zoom, self.origin_y + (y2 + 1) * self.zoom)
+
+    def add_overlay(self, box, fill='black'):
+        """Draws a filled rectangle over the image at <box> (image coordinates). Returns its canvas item"""
+        item = self.canvas.create_rectangle(*self._overlay_coords(box), fill=fill, outline='', tags=(OVERLAY_TAG,))
+        self.overlays[item] = box
+        return item
+
+    def remove_overlay(self, item):
+        self.canvas.delete(item)
+        self.overlays.pop(item, None)
+
+    def canvas_to_image(self, x, y):
+        return int((x - self.origin_x) / self.zoom), int((y - self.origin_y) / self.zoom)
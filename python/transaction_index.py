@@ -0,0 +1,213 @@
+import re
+import sys
+from collections import defaultdict, Counter
+from python.page_cache import file_signature
+from python.statement_parser import TransactionStore
+from python.multi_pattern import AhoCorasick
+from python.profiling import profiler
+
+TOKEN_PATTERN = re.compile(r'[A-Z0-9]+')
+DEFAULT_FUZZY_THRESHOLD = 0.5
+
+def trigrams(word):
+    """Trigrams of a word padded like pg_trgm does, so that short words and word starts weigh more"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TransactionIndex:
+    """
+    In-memory inverted index over the transactions of the eStatements.
+    Every page is parsed once into the TransactionStore. Searches then look up the
+    token -> record ids and (month, day) -> record ids maps instead of rescanning every line
+    of every page. Tokens come from the whole text of a transaction, continuation lines included,
+    so that a merchant name wrapped onto a second statement line is still found.
+    """
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.store = TransactionStore()
+        self.file_order = {}
+        self.signatures = {}
+        self.file_records = {}
+        self.tokens = defaultdict(set)
+        self.dates = defaultdict(set)
+        # Fuzzy search over descriptions: description word -> record ids, trigram -> words
+        self.words = defaultdict(set)
+        self.word_trigrams = defaultdict(set)
+        self.word_sizes = {}
+
+    def update(self, cache, file_paths):
+        """Indexes the new or changed files among <file_paths> and drops the files that are gone"""
+        self.set_files(file_paths)
+        for file_path in file_paths:
+            if not self.is_current(file_path):
+                self.update_file(cache, file_path)
+
+    def set_files(self, file_paths):
+        """Sets the archive order of the statements and drops the ones that are gone"""
+        self.file_order = {file_path: i for i, file_path in enumerate(file_paths)}
+        for file_path in list(self.file_records):
+            if file_path not in self.file_order:
+                self.remove_file(file_path)
+
+    def is_current(self, file_path):
+        try:
+            return self.signatures.get(file_path) == file_signature(file_path)
+        except OSError:
+            return False
+
+    def update_file(self, cache, file_path):
+        """(Re)indexes a single statement. Returns False if its text could not be extracted"""
+        try:
+            with profiler.span("index_statement", file=file_path):
+                signature = file_signature(file_path)
+                self.remove_file(file_path)
+                self.add_file(file_path, cache.get_page_texts(file_path))
+                self.signatures[file_path] = signature
+            return True
+        except Exception as e:
+            print(f"Error processing {file_path}: {str(e)}", file=sys.stderr)
+            return False
+
+    def add_file(self, file_path, page_texts):
+        if self.debug:
+            print(f"Indexing file: {file_path}", file=sys.stderr)
+        # Registered before parsing, so that a scan interrupted half-way can be undone by remove_file
+        record_ids = self.file_records[file_path] = []
+        for page_num, text in enumerate(page_texts, 1):
+            record_ids.extend(self.store.add_page(file_path, page_num, text.split('\n')))
+        for record_id in record_ids:
+            record = self.store[record_id]
+            for token in TOKEN_PATTERN.findall(record.text.upper()):
+                self.tokens[token].add(record_id)
+            self.dates[(record.month, record.day)].add(record_id)
+            if record.posting_month:
+                self.dates[(record.posting_month, record.posting_day)].add(record_id)
+            for word in TOKEN_PATTERN.findall(record.description.upper()):
+                self.words[word].add(record_id)
+                if word not in self.word_sizes:
+                    word_trigrams = trigrams(word)
+                    self.word_sizes[word] = len(word_trigrams)
+                    for trigram in word_trigrams:
+                        self.word_trigrams[trigram].add(word)
+
+    def remove_file(self, file_path):
+        if file_path not in self.file_records:
+            return
+        self.signatures.pop(file_path, None)
+        del self.file_records[file_path]
+        removed = set(self.store.remove_file(file_path))
+        # Words left without records stay in word_trigrams; they no longer lead to any record
+        for postings_map in (self.tokens, self.dates, self.words):
+            for key in list(postings_map):
+                postings_map[key] -= removed
+                if not postings_map[key]:
+                    del postings_map[key]
+
+    def _sorted_records(self, record_ids):
+        """Records in archive order: file in os.walk order, then page, then line"""
+        records = [self.store[record_id] for record_id in record_ids]
+        return sorted(records, key=lambda r: (self.file_order.get(r.file, len(self.file_order)), r.page, r.first_line))
+
+    def build_matcher(self, search_terms, case_sensitive=False):
+        """
+        Automaton over <search_terms>; matches are tagged with these (upper-cased unless case_sensitive) terms.
+        Whitespace in the terms is collapsed like in the record texts
+        """
+        search_terms = [' '.join(term.split()) for term in search_terms]
+        return AhoCorasick(search_terms if case_sensitive else [term.upper() for term in search_terms])
+
+    def _candidates(self, matcher):
+        """Record ids whose text may contain one of the terms; a superset of the ones that actually do"""
+        query_tokens = {term: TOKEN_PATTERN.findall(term.upper()) for term in matcher.patterns}
+        if not all(query_tokens.values()):
+            return {record_id for record_ids in self.file_records.values() for record_id in record_ids}
+
+        # A term may start or end in the middle of a word, so tokens are matched by substring,
+        # for all the terms at once with a single pass over the vocabulary
+        token_matcher = AhoCorasick(token for tokens in query_tokens.values() for token in tokens)
+        token_postings = defaultdict(set)
+        for token, postings in self.tokens.items():
+            for query_token in token_matcher.matches(token):
+                token_postings[query_token] |= postings
+
+        candidates = set()
+        for tokens in query_tokens.values():
+            candidates |= set.intersection(*(token_postings[token] for token in tokens))
+        return candidates
+
+    def _match_records(self, record_ids, matcher, case_sensitive):
+        matches = []
+        for record_id in record_ids:
+            text = self.store.texts[record_id]
+            matched_terms = matcher.matches(text if case_sensitive else text.upper())
+            if matched_terms:
+                matches.append((record_id, matched_terms))
+        return matches
+
+    def lookup_patterns(self, matcher, case_sensitive=False):
+        """
+        Returns (record, matched_terms) for the records whose text contains any of the terms
+        of <matcher>, in archive order
+        """
+        matches = dict(self._match_records(self._candidates(matcher), matcher, case_sensitive))
+        return [(record, matches[record.record_id]) for record in self._sorted_records(matches)]
+
+    def lookup(self, search_terms, case_sensitive=False):
+        """Returns the records whose text contains any of <search_terms>, in archive order"""
+        matcher = self.build_matcher(search_terms, case_sensitive)
+        return [record for record, _ in self.lookup_patterns(matcher, case_sensitive)]
+
+    def match_file(self, file_path, matcher=None, dates=None, case_sensitive=False):
+        """
+        Same as lookup_patterns/lookup_dates, restricted to the records of one statement. Scans them
+        directly, which is cheaper than the token lookup right after the file was indexed.
+        Returns (record, matched_terms) tuples; matched_terms is empty for date searches.
+        """
+        record_ids = self.file_records.get(file_path, [])
+        if dates is not None:
+            matches = [(record_id, []) for record_id in record_ids
+                       if (self.store.months[record_id], self.store.days[record_id]) in dates
+                       or (self.store.posting_months[record_id], self.store.posting_days[record_id]) in dates]
+        else:
+            matches = self._match_records(record_ids, matcher, case_sensitive)
+        records = [(self.store[record_id], matched_terms) for record_id, matched_terms in matches]
+        return sorted(records, key=lambda match: (match[0].page, match[0].first_line))
+
+    def lookup_dates(self, dates):
+        """Returns the records with a transaction or posting date among the (month, day) <dates>"""
+        matches = set()
+        for date in dates:
+            matches |= self.dates.get(date, set())
+        return self._sorted_records(matches)
+
+    def fuzzy_lookup(self, query, threshold=DEFAULT_FUZZY_THRESHOLD):
+        """
+        Ranked fuzzy search over the transaction descriptions, for merchant names that the statements
+        truncate or mangle ("PIZZAIOL", "PIZZAIOLO #12"). Every query word scores the trigram similarity
+        of its closest description word, and a record scores the average over the query words.
+        Only the transactions starting on a dated line are indexed, so headers never match.
+        Returns (record, score) for the records scoring at least <threshold>, best first.
+        """
+        query_words = TOKEN_PATTERN.findall(query.upper())
+        if not query_words:
+            return []
+
+        scores = defaultdict(float)
+        for query_word in query_words:
+            query_trigrams = trigrams(query_word)
+            shared = Counter()
+            for trigram in query_trigrams:
+                for word in self.word_trigrams.get(trigram, ()):
+                    shared[word] += 1
+
+            best_scores = {}
+            for word, shared_count in shared.items():
+                score = shared_count / (len(query_trigrams) + self.word_sizes[word] - shared_count)
+                for record_id in self.words.get(word, ()):
+                    if score > best_scores.get(record_id, 0):
+                        best_scores[record_id] = score
+            for record_id, score in best_scores.items():
+                scores[record_id] += score / len(query_words)
+
+        records = self._sorted_records(record_id for record_id, score in scores.items() if score >= threshold)
+        return sorted(((record, scores[record.record_id]) for record in records), key=lambda match: -match[1])
@@ -0,0 +1,143 @@
+import os
+import re
+import sys
+import time
+import argparse
+from python.page_cache import PageTextCache, iter_pdf_files, file_signature
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# RBC downloads are named like "Chequing Statement-8681 2024-01-15.pdf"
+STATEMENT_NAME_PATTERN = re.compile(r'^.*Statement-\d+ \d{4}-(.+\.pdf)$')
+
+def normalize_statement_name(file_path):
+    """
+    Renames a freshly downloaded statement the way scripts/rename_estatements.sh does,
+    e.g. "Chequing Statement-8681 2024-01-15.pdf" -> "01-15.pdf".
+    Returns the path of the file after renaming.
+    """
+    directory, file_name = os.path.split(file_path)
+    match = STATEMENT_NAME_PATTERN.match(file_name)
+    if not match:
+        return file_path
+    new_path = os.path.join(directory, match.group(1))
+    if os.path.exists(new_path):
+        print(f"Not renaming {file_path}: {new_path} already exists")
+        return file_path
+    os.rename(file_path, new_path)
+    print(f"File renamed to: {new_path}")
+    return new_path
+
+class StatementWatcher:
+    """
+    Watches the eStatements directory and adds new or changed statements to the page text
+    cache as soon as they appear, so that the next search does not have to extract them.
+    Uses inotify when the inotify_simple package is available, and polls otherwise.
+    """
+    def __init__(self, estatements_dir, poll_interval=5, debug=False):
+        self.estatements_dir = os.path.abspath(estatements_dir)
+        self.poll_interval = poll_interval
+        self.debug = debug
+        self.cache = PageTextCache(self.estatements_dir, debug=debug)
+
+    def handle(self, file_path):
+        """Normalizes the name of a new or changed statement and caches its text"""
+        if not os.path.exists(file_path):
+            return
+        file_path = normalize_statement_name(file_path)
+        if self.cache.is_fresh(file_path):
+            return
+        try:
+            self.cache.get_page_texts(file_path)
+            print(f"Indexed: {file_path}")
+        except Exception as e:
+            print(f"Error processing {file_path}: {str(e)}", file=sys.stderr)
+
+    def sync(self):
+        """Catches up with the statements that were added or removed while nothing was watching"""
+        for file_path in list(iter_pdf_files(self.estatements_dir)):
+            self.handle(file_path)
+        for file_path in self.cache.prune():
+            print(f"Removed: {file_path}")
+
+    def watch(self, use_inotify=True):
+        self.sync()
+        print(f"Watching {self.estatements_dir} for new statements. Press Ctrl-C to stop.")
+        try:
+            if use_inotify and INotify is not None:
+                self._watch_inotify()
+            else:
+                self._watch_polling()
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+        finally:
+            self.cache.close()
+
+    def _watch_polling(self):
+        # A file is only handled once its signature stayed the same for a whole interval,
+        # so that statements still being downloaded are not extracted half-written
+        previous = {}
+        while True:
+            current = {}
+            for file_path in iter_pdf_files(self.estatements_dir):
+                try:
+                    current[file_path] = file_signature(file_path)
+                except FileNotFoundError:
+                    continue
+            for file_path, signature in current.items():
+                if previous.get(file_path) == signature:
+                    self.handle(file_path)
+            if previous.keys() - current.keys():
+                for file_path in self.cache.prune():
+                    print(f"Removed: {file_path}")
+            previous = current
+            time.sleep(self.poll_interval)
+
+    def _watch_inotify(self):
+        inotify = INotify()
+        watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE
+        directories = {}
+
+        def add_watch(directory):
+            for root, _, _ in os.walk(directory):
+                directories[inotify.add_watch(root, watch_flags)] = root
+
+        add_watch(self.estatements_dir)
+        while True:
+            for event in inotify.read():
+                directory = directories.get(event.wd)
+                if directory is None or not event.name:
+                    continue
+                path = os.path.join(directory, event.name)
+                event_flags = flags.from_mask(event.mask)
+                if flags.ISDIR in event_flags:
+                    if flags.CREATE in event_flags or flags.MOVED_TO in event_flags:
+                        add_watch(path)
+                        for file_path in list(iter_pdf_files(path)):
+                            self.handle(file_path)
+                    continue
+                if not event.name.endswith('.pdf'):
+                    continue
+                if flags.CLOSE_WRITE in event_flags or flags.MOVED_TO in event_flags:
+                    self.handle(path)
+                elif flags.DELETE in event_flags or flags.MOVED_FROM in event_flags:
+                    self.cache.forget(path)
+                    if self.debug:
+                        print(f"Removed: {path}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Index new eStatements as soon as they are downloaded.")
+    parser.add_argument("estatements_directory", help="Directory containing eStatements PDFs")
+    parser.add_argument("--poll-interval", type=float, default=5, help="Seconds between scans when polling")
+    parser.add_argument("--polling", action="store_true", help="Poll even if inotify is available")
+    parser.add_argument("--debug", action="store_true", help="Print every extracted file")
+    args = parser.parse_args()
+
+    watcher = StatementWatcher(args.estatements_directory, args.poll_interval, args.debug)
+    watcher.watch(use_inotify=not args.polling)
+
+if __name__ == "__main__":
+    main()